@@ -0,0 +1,151 @@
+"""Admission control primitives for the LLM-backed scan endpoints.
+
+All three guards are in-process and per worker: a token bucket per client, a
+bounded admission queue in front of the model client, and a circuit breaker
+that fails fast while the upstream is degraded. Rejections carry a
+`retry_after` hint in seconds for the HTTP layer's Retry-After header.
+"""
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+from cachetools import TTLCache
+
+
+class Rejected(Exception):
+    """Raised when a request should be turned away; retry_after is in seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class RateLimited(Rejected):
+    pass
+
+
+class QueueFull(Rejected):
+    pass
+
+
+class CircuitOpen(Rejected):
+    pass
+
+
+class TokenBucketLimiter:
+    """Per-key token buckets refilled continuously at rate_per_minute.
+
+    Buckets are dropped once idle long enough to have refilled completely,
+    which is indistinguishable from keeping them, so memory stays bounded.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, max_clients: int = 10000):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self._buckets = TTLCache(maxsize=max_clients, ttl=burst / self.rate)
+
+    def acquire(self, key: str, cost: float = 1.0):
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        if tokens < cost:
+            self._buckets[key] = (tokens, now)
+            raise RateLimited("Too many scan requests", (cost - tokens) / self.rate)
+        self._buckets[key] = (tokens - cost, now)
+
+
+class AdmissionQueue:
+    """Bounded concurrency with a bounded wait queue in front of it.
+
+    At most `concurrency` holders run at once and at most `max_queue` more may
+    wait; anyone beyond that is rejected immediately instead of piling up.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._admitted = 0
+        self._avg_seconds = 5.0
+
+    @property
+    def in_flight(self) -> int:
+        return self._admitted
+
+    @asynccontextmanager
+    async def slot(self, wait: bool = False):
+        """Hold a run slot; with wait=True, skip the queue bound (background work)"""
+        if not wait and self._admitted >= self.concurrency + self.max_queue:
+            waiting = self._admitted - self.concurrency + 1
+            raise QueueFull("Scan queue is full", self._avg_seconds * waiting / self.concurrency)
+
+        self._admitted += 1
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                try:
+                    yield
+                finally:
+                    # Exponentially weighted average call time for Retry-After hints
+                    self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (time.monotonic() - started)
+        finally:
+            self._admitted -= 1
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures and lets one trial call through after a cooldown"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_seconds:
+            return "half_open"
+        return "open"
+
+    def check(self):
+        """Fail fast while open, without claiming the half-open trial call"""
+        if self.state == "open":
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            raise CircuitOpen("Scanning is temporarily unavailable", remaining)
+
+    def before_call(self):
+        self.check()
+        if self.state == "half_open":
+            if self._trial_running:
+                raise CircuitOpen("Scanning is temporarily unavailable", self.reset_seconds)
+            self._trial_running = True
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    def record_failure(self):
+        self._failures += 1
+        self._trial_running = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+    @asynccontextmanager
+    async def guard(self):
+        self.before_call()
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            # Cancellation says nothing about upstream health
+            self._trial_running = False
+            raise
+        self.record_success()
@@ -0,0 +1,370 @@
+"""Load benchmark for the voucher API.
+
+Usage (from the backend directory, against a local mongod):
+    python benchmark.py --vouchers 1000 10000 100000 --concurrency 16 --requests 1000 \
+        --output bench.json [--baseline previous.json]
+
+For every voucher count the benchmark reseeds a dedicated database
+(DB_NAME, default `vouchervault_bench`; it must contain "bench" unless --force
+is given), then drives each scenario with concurrent clients and records
+p50/p90/p99 latency, throughput, status codes and process memory. Requests go
+through the ASGI app in-process, so the numbers cover routing, validation,
+serialization and MongoDB, but not uvicorn or the network; pass --url to hit a
+running server instead (seeded through the same database).
+
+The LLM is replaced by a stub that answers after --llm-latency-ms, and Drive is
+never called (no credentials are seeded), so runs are local and repeatable.
+With --baseline, p50/p99 are compared against an earlier results file and the
+exit status is 1 if any scenario regressed by more than --max-regression percent.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# server reads its configuration at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "vouchervault_bench")
+os.environ.setdefault("SCAN_RATE_PER_MINUTE", "1000000000")
+os.environ.setdefault("SCAN_RATE_BURST", "1000000000")
+
+import httpx
+from PIL import Image
+
+import server
+
+SEED_BATCH_SIZE = 5000
+BRANDS = ["Starbucks", "Target", "Walmart", "Costa Coffee", "Nike", "Adidas", "IKEA", "Zara",
+          "H&M", "Uniqlo", "Tesco", "Carrefour", "Decathlon", "Sephora", "Apple", "Amazon"]
+CATEGORIES = ["food", "fashion", "electronics", "groceries", "travel", "beauty", None]
+CURRENCIES = ["USD", "EUR", "GBP", "SGD", "JPY"]
+REGIONS = ["Singapore", "London", "New York", "Paris", "Tokyo", "Berlin"]
+CITIES = {
+    "Singapore": (1.3521, 103.8198),
+    "London": (51.5072, -0.1276),
+    "New York": (40.7128, -74.0060),
+    "Paris": (48.8566, 2.3522),
+    "Tokyo": (35.6762, 139.6503),
+    "Berlin": (52.5200, 13.4050)
+}
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies, statuses, wall_seconds: float, rss_before: float) -> dict:
+    ordered = sorted(latencies)
+    ok = sum(count for status, count in statuses.items() if status < 400)
+    return {
+        "requests": len(latencies),
+        "ok": ok,
+        "errors": len(latencies) - ok,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "throughput_rps": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ordered, 0.50) * 1000, 3),
+            "p90": round(percentile(ordered, 0.90) * 1000, 3),
+            "p99": round(percentile(ordered, 0.99) * 1000, 3),
+            "mean": round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0
+        },
+        "rss_mb": {"before": round(rss_before, 1), "after": round(rss_mb(), 1), "peak": round(peak_rss_mb(), 1)}
+    }
+
+
+def random_voucher(rng: random.Random, now: datetime) -> server.Voucher:
+    region = rng.choice(REGIONS)
+    store_type = rng.choices(["specific", "regional", "international"], weights=[5, 3, 2])[0]
+    brand = rng.choice(BRANDS)
+    fields = {
+        "brand_name": brand,
+        "discount_amount": f"{rng.choice([5, 10, 15, 20, 25, 50])}%",
+        "currency": rng.choice(CURRENCIES),
+        "voucher_code": f"{brand[:3].upper()}{rng.randrange(10 ** 8):08d}",
+        "expiry_date": now + timedelta(days=rng.randint(-30, 365), hours=rng.randint(0, 23)),
+        "store_type": store_type,
+        "category": rng.choice(CATEGORIES),
+        "created_at": now - timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86399))
+    }
+    if store_type == "specific":
+        fields["store_location"] = f"{rng.randint(1, 500)} {rng.choice(['High St', 'Orchard Rd', 'Main St', 'Market Sq'])}"
+    if store_type != "international":
+        fields["region"] = region
+        lat, lng = CITIES[region]
+        fields["latitude"] = round(lat + rng.uniform(-0.1, 0.1), 6)
+        fields["longitude"] = round(lng + rng.uniform(-0.1, 0.1), 6)
+    return server.Voucher(**fields)
+
+
+async def seed(count: int, rng: random.Random) -> float:
+    """Replace the benchmark database's vouchers with `count` generated ones"""
+    started = time.perf_counter()
+    db = server.db
+    for collection in ("vouchers", "voucher_tombstones", "pending_reminders", "counters", "migrations"):
+        await db[collection].delete_many({})
+    await db.reminder_settings.update_one(
+        {"id": "reminder_settings"},
+        {"$set": {"id": "reminder_settings", "reminder_days": [7, 3, 1], "browser_notifications_enabled": True}},
+        upsert=True
+    )
+    server.reminder_settings_cache.invalidate()
+
+    now = datetime.now(timezone.utc)
+    seq = 0
+    for start in range(0, count, SEED_BATCH_SIZE):
+        docs = []
+        for _ in range(min(SEED_BATCH_SIZE, count - start)):
+            seq += 1
+            doc = server.voucher_document(random_voucher(rng, now), [7, 3, 1])
+            doc["change_seq"] = seq
+            docs.append(doc)
+        await db.vouchers.insert_many(docs, ordered=False)
+    await db.counters.update_one({"id": "voucher_changes"}, {"$set": {"seq": seq}}, upsert=True)
+
+    server.stats_cache.invalidate()
+    await server.refresh_brand_index()
+    return time.perf_counter() - started
+
+
+def scan_images(count: int, rng: random.Random):
+    """Distinct small JPEGs so scans miss the result cache"""
+    images = []
+    for _ in range(count):
+        image = Image.new("RGB", (640, 480), tuple(rng.randrange(256) for _ in range(3)))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=80)
+        images.append(base64.b64encode(buffer.getvalue()).decode("ascii"))
+    return images
+
+
+def build_scenarios(args, rng: random.Random, in_process: bool):
+    """(name, request factory) pairs; a factory returns (method, path, kwargs)"""
+    def voucher_body():
+        return random_voucher(rng, datetime.now(timezone.utc)).model_dump(mode="json", exclude={"id", "created_at"})
+
+    def nearby_geo():
+        lat, lng = CITIES[rng.choice(REGIONS)]
+        return "POST", "/api/vouchers/nearby", {"json": {"latitude": lat, "longitude": lng, "radius_km": 10}}
+
+    scenarios = [
+        ("list_vouchers", lambda: ("GET", "/api/vouchers", {"params": {"limit": 100}})),
+        ("list_vouchers_filtered", lambda: ("GET", "/api/vouchers", {"params": {"limit": 100, "category": rng.choice(CATEGORIES[:-1])}})),
+        ("expiring_soon", lambda: ("GET", "/api/vouchers/expiring-soon", {"params": {"days": 7}})),
+        ("stats", lambda: ("GET", "/api/vouchers/stats", {})),
+        ("nearby_geo", nearby_geo),
+        ("nearby_store", lambda: ("POST", "/api/vouchers/nearby", {"json": {"store_name": rng.choice(BRANDS)[:4]}})),
+        ("nearby_region", lambda: ("POST", "/api/vouchers/nearby", {"json": {"region": rng.choice(REGIONS)}})),
+        ("create_voucher", lambda: ("POST", "/api/vouchers", {"json": voucher_body()}))
+    ]
+    if in_process:
+        images = itertools.cycle(scan_images(args.requests + args.warmup, rng))
+        scenarios.append(("scan_image_stubbed_llm", lambda: (
+            "POST", "/api/vouchers/scan-image", {"json": {"image_base64": next(images)}}
+        )))
+    return [(name, factory) for name, factory in scenarios if not args.scenarios or name in args.scenarios]
+
+
+async def drive(client: httpx.AsyncClient, factory, total: int, concurrency: int) -> dict:
+    """Issue `total` requests from `concurrency` concurrent clients"""
+    latencies = []
+    statuses = {}
+    issued = 0
+
+    async def worker():
+        nonlocal issued
+        while issued < total:
+            issued += 1
+            method, path, kwargs = factory()
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+                status = response.status_code
+            except httpx.HTTPError:
+                status = 599
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started, rss_before)
+
+
+async def time_reminder_checks(iterations: int) -> dict:
+    """First check after seeding handles everything due; later ones find nothing due"""
+    results = {}
+    for name, runs in (("reminder_check_due", 1), ("reminder_check_idle", iterations)):
+        latencies = []
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        for _ in range(runs):
+            run_started = time.perf_counter()
+            await server.check_and_send_reminders()
+            latencies.append(time.perf_counter() - run_started)
+        results[name] = summarize(latencies, {200: runs}, time.perf_counter() - started, rss_before)
+    results["reminder_check_due"]["reminders_queued"] = await server.db.pending_reminders.count_documents({})
+    return results
+
+
+async def stub_extract_voucher_details(image_base64: str, latency_ms: float) -> dict:
+    await asyncio.sleep(latency_ms / 1000)
+    return {"brand_name": "Benchmark", "discount_amount": "10%", "voucher_code": "BENCH10",
+            "expiry_date": "2030-01-01", "currency": "USD"}
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Print p50/p99 deltas against a baseline run; returns False on a regression"""
+    previous = {
+        (run["vouchers"], name): scenario
+        for run in baseline.get("runs", [])
+        for name, scenario in run["scenarios"].items()
+    }
+    ok = True
+    print(f"{'vouchers':>9} {'scenario':<24} {'p50 ms':>10} {'Δp50':>8} {'p99 ms':>10} {'Δp99':>8}")
+    for run in results["runs"]:
+        for name, scenario in run["scenarios"].items():
+            before = previous.get((run["vouchers"], name))
+            if not before:
+                continue
+            row = [f"{run['vouchers']:>9}", f"{name:<24}"]
+            for key in ("p50", "p99"):
+                old, new = before["latency_ms"][key], scenario["latency_ms"][key]
+                change = (new - old) / old * 100 if old else 0.0
+                flag = "!" if change > max_regression else " "
+                ok = ok and change <= max_regression
+                row += [f"{new:>10.2f}", f"{change:>+7.1f}%{flag}"]
+            print(" ".join(row))
+    return ok
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    in_process = not args.url
+    original_extract = server.extract_voucher_details
+    server.extract_voucher_details = lambda image_base64: stub_extract_voucher_details(image_base64, args.llm_latency_ms)
+
+    await server.startup_event()
+    if in_process:
+        # Unhandled errors become 500s and are counted instead of aborting the run
+        transport = httpx.ASGITransport(app=server.app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout)
+    else:
+        limits = httpx.Limits(max_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits)
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "target": args.url or "in-process",
+            "database": os.environ["DB_NAME"],
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "llm_latency_ms": args.llm_latency_ms,
+            "seed": args.seed
+        },
+        "runs": []
+    }
+    try:
+        for count in args.vouchers:
+            print(f"Seeding {count} vouchers...", flush=True)
+            seed_seconds = await seed(count, rng)
+            run_result = {"vouchers": count, "seed_seconds": round(seed_seconds, 2), "scenarios": {}}
+
+            for name, factory in build_scenarios(args, rng, in_process):
+                # Warm-up requests prime caches and connection pools, and are not recorded
+                await drive(client, factory, min(args.warmup, args.requests), args.concurrency)
+                summary = await drive(client, factory, args.requests, args.concurrency)
+                run_result["scenarios"][name] = summary
+                print(f"  {name:<24} p50 {summary['latency_ms']['p50']:>9.2f} ms  "
+                      f"p99 {summary['latency_ms']['p99']:>9.2f} ms  "
+                      f"{summary['throughput_rps']:>9.1f} req/s  errors {summary['errors']}", flush=True)
+
+            if not args.scenarios or "reminder_check" in args.scenarios:
+                run_result["scenarios"].update(await time_reminder_checks(args.reminder_iterations))
+            results["runs"].append(run_result)
+    finally:
+        await client.aclose()
+        server.extract_voucher_details = original_extract
+        await server.shutdown_db_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the voucher API against a seeded database")
+    parser.add_argument("--vouchers", type=int, nargs="+", default=[1000, 10000], help="voucher counts to seed, one run each")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients per scenario")
+    parser.add_argument("--requests", type=int, default=500, help="recorded requests per scenario")
+    parser.add_argument("--warmup", type=int, default=50, help="unrecorded requests before each scenario")
+    parser.add_argument("--scenarios", nargs="*", help="only run these scenarios (reminder_check included)")
+    parser.add_argument("--reminder-iterations", type=int, default=20, help="idle reminder checks to time")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated model latency for scans")
+    parser.add_argument("--url", help="benchmark a running server at this base URL instead of in-process")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for generated data and requests")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the JSON results")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0, help="allowed p50/p99 slowdown in percent")
+    parser.add_argument("--force", action="store_true", help="allow a database name without 'bench' in it")
+    args = parser.parse_args()
+
+    if "bench" not in os.environ["DB_NAME"] and not args.force:
+        parser.error(f"refusing to reseed database {os.environ['DB_NAME']!r}; use a *bench* DB_NAME or --force")
+    if server.STORAGE_BACKEND != "mongo":
+        parser.error("the benchmark seeds MongoDB directly; unset STORAGE_BACKEND or set it to 'mongo'")
+
+    results = asyncio.run(run(args))
+    with open(args.output, "w") as output:
+        json.dump(results, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            if not compare(results, json.load(baseline), args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Google Drive backup engine.
+
+googleapiclient and google-auth are synchronous (httplib2/requests), so every
+Drive call made here runs on one dedicated worker thread and the event loop
+only awaits the result. A single thread also keeps the non-thread-safe
+httplib2 transport to one caller at a time. Syncs are single-flight: starting
+a sync while one is running joins the running one.
+
+Set DRIVE_API_ROOT (e.g. http://127.0.0.1:8089/) to point both the API and
+the upload endpoints at a local fake Drive server.
+
+The Google client libraries are slow to import, so they are only imported
+on first use (always on the Drive thread), keeping them off the startup path.
+"""
+import asyncio
+import functools
+import gzip
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Awaitable, Callable, Optional
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+def build_drive_service(credentials):
+    """Build a Drive v3 client from the bundled discovery document (blocking)"""
+    from googleapiclient.discovery import build, build_from_document
+    from googleapiclient.discovery_cache import get_static_doc
+
+    api_root = os.environ.get('DRIVE_API_ROOT')
+    if not api_root:
+        return build('drive', 'v3', credentials=credentials, static_discovery=True, cache_discovery=False)
+
+    document = json.loads(get_static_doc('drive', 'v3'))
+    document['rootUrl'] = document['mtlsRootUrl'] = api_root
+    return build_from_document(document, credentials=credentials)
+
+
+def credentials_from_doc(creds_doc: dict) -> "Credentials":
+    """Rebuild OAuth credentials, including expiry, from a drive_credentials document"""
+    from google.oauth2.credentials import Credentials
+
+    expiry = creds_doc.get("expiry")
+    if isinstance(expiry, str):
+        expiry = datetime.fromisoformat(expiry)
+    if isinstance(expiry, datetime) and expiry.tzinfo is not None:
+        # google-auth compares expiry against naive UTC timestamps
+        expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return Credentials(
+        token=creds_doc["access_token"],
+        refresh_token=creds_doc.get("refresh_token"),
+        token_uri=creds_doc["token_uri"],
+        client_id=creds_doc["client_id"],
+        client_secret=creds_doc["client_secret"],
+        scopes=creds_doc["scopes"],
+        expiry=expiry
+    )
+
+
+def refresh_credentials(credentials: "Credentials"):
+    """Refresh an expired access token in place (blocking)"""
+    from google.auth.transport.requests import Request as GoogleRequest
+
+    credentials.refresh(GoogleRequest())
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class BackupWriter:
+    """Gzip-compressed NDJSON written to a spooled temp file (blocking).
+
+    Output stays in memory up to SPOOL_BYTES and moves to disk beyond that,
+    so a backup of any size uploads with bounded memory.
+    """
+
+    SPOOL_BYTES = 8 * 1024 * 1024
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=self.SPOOL_BYTES)
+        self._gzip = gzip.GzipFile(fileobj=self.file, mode="wb")
+        self.lines = 0
+
+    def write(self, records):
+        for record in records:
+            self._gzip.write(json.dumps(record, separators=(",", ":"), default=json_default).encode("utf-8"))
+            self._gzip.write(b"\n")
+            self.lines += 1
+
+    def finish(self):
+        """Close the gzip stream and rewind; returns the file object to upload"""
+        self._gzip.close()
+        self.file.seek(0)
+        return self.file
+
+    def close(self):
+        self.file.close()
+
+
+def create_file(service, name: str, stream, mimetype: str) -> str:
+    """Upload a new file and return its id (blocking)"""
+    from googleapiclient.http import MediaIoBaseUpload
+
+    media = MediaIoBaseUpload(stream, mimetype=mimetype, resumable=True)
+    created = service.files().create(
+        body={'name': name, 'mimeType': mimetype},
+        media_body=media,
+        fields='id'
+    ).execute()
+    return created['id']
+
+
+def delete_file(service, file_id: str):
+    """Delete a file, ignoring ones that are already gone (blocking)"""
+    from googleapiclient.errors import HttpError
+
+    try:
+        service.files().delete(fileId=file_id).execute()
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+
+
+def upload_file(service, name: str, stream, mimetype: str) -> str:
+    """Create or overwrite a file by name in the app's Drive space (blocking)"""
+    from googleapiclient.http import MediaIoBaseUpload
+
+    results = service.files().list(
+        q=f"name='{name}' and trashed=false",
+        spaces='drive',
+        fields='files(id, name)'
+    ).execute()
+    files = results.get('files', [])
+
+    if files:
+        file_id = files[0]['id']
+        media = MediaIoBaseUpload(stream, mimetype=mimetype, resumable=True)
+        service.files().update(fileId=file_id, media_body=media).execute()
+        return file_id
+
+    return create_file(service, name, stream, mimetype)
+
+
+class DriveSyncEngine:
+    """Runs blocking Drive calls off the event loop and serializes syncs"""
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="drive")
+        self._task: Optional[asyncio.Task] = None
+
+    async def call(self, fn: Callable, *args, **kwargs):
+        """Run a blocking Drive/auth call on the Drive thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, sync: Callable[[], Awaitable[dict]]) -> asyncio.Task:
+        """Start a sync in the background, or return the one already running"""
+        if not self.running:
+            self._task = asyncio.create_task(sync())
+            # Failures are reported through sync status; don't warn about unretrieved errors
+            self._task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._task
+
+    def shutdown(self):
+        if self._task is not None:
+            self._task.cancel()
+        self._executor.shutdown(wait=False)
+
+
+class DriveServiceCache:
+    """Process-wide Drive client, rebuilt only when the stored credentials change.
+
+    The cache key is the stored access token plus its updated_at stamp, so a
+    reconnect or refresh made by another worker is picked up on the next call.
+    The key from before our own latest refresh is still accepted, since
+    callers may have read the document just before that refresh landed.
+    Building and refreshing happen under one lock, so concurrent syncs share a
+    single token refresh instead of racing each other.
+    """
+
+    def __init__(self, engine: DriveSyncEngine):
+        self._engine = engine
+        self._lock = asyncio.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        self._keys = set()
+        self._latest_key = None
+        self._credentials = None
+        self._service = None
+
+    async def get(self, creds_doc: dict, on_refresh: Callable[["Credentials"], Awaitable[str]]):
+        """Return a ready Drive client; on_refresh persists a new token and returns its updated_at"""
+        key = (creds_doc.get("access_token"), creds_doc.get("updated_at"))
+        async with self._lock:
+            if self._service is None or key not in self._keys:
+                self._credentials = await self._engine.call(credentials_from_doc, creds_doc)
+                self._service = await self._engine.call(build_drive_service, self._credentials)
+                self._keys = {key}
+                self._latest_key = key
+
+            # The client holds this credentials object, so refreshing in place updates it
+            if self._credentials.expired and self._credentials.refresh_token:
+                await self._engine.call(refresh_credentials, self._credentials)
+                updated_at = await on_refresh(self._credentials)
+                refreshed_key = (self._credentials.token, updated_at)
+                self._keys = {self._latest_key, refreshed_key}
+                self._latest_key = refreshed_key
+
+            return self._service
@@ -0,0 +1,69 @@
+"""Declarative MongoDB index setup.
+
+Indexes are declared once as `IndexModel`s per collection. `ensure_indexes`
+reads each collection's existing indexes, skips any whose key pattern is
+already present, and builds the rest concurrently, one createIndexes command
+per index so a failure (e.g. duplicates blocking a unique index) only affects
+that index. It is meant to run in the background after startup.
+"""
+import asyncio
+import logging
+from typing import Dict, List
+
+from pymongo import IndexModel
+
+logger = logging.getLogger(__name__)
+
+
+def _key_pattern(keys) -> tuple:
+    return tuple((field, direction) for field, direction in keys.items())
+
+
+async def _ensure_collection(collection, models: List[IndexModel]) -> Dict[str, int]:
+    existing = {}
+    async for index in collection.list_indexes():
+        existing[_key_pattern(index["key"])] = index
+
+    missing = []
+    for model in models:
+        document = model.document
+        current = existing.get(_key_pattern(document["key"]))
+        if current is None:
+            missing.append(model)
+            continue
+        for option in ("unique", "sparse", "expireAfterSeconds"):
+            if current.get(option) != document.get(option):
+                # Changing options means dropping the index first; leave that to an operator
+                logger.warning(
+                    f"Index {current['name']} on {collection.name} has {option}={current.get(option)!r}, "
+                    f"declared {document.get(option)!r}"
+                )
+
+    results = await asyncio.gather(
+        *(collection.create_indexes([model]) for model in missing),
+        return_exceptions=True
+    )
+    failed = 0
+    for model, result in zip(missing, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"Failed to create index {model.document['name']} on {collection.name}: {str(result)}")
+
+    return {"existing": len(models) - len(missing), "created": len(missing) - failed, "failed": failed}
+
+
+async def ensure_indexes(db, declared: Dict[str, List[IndexModel]]) -> Dict[str, int]:
+    """Create every declared index that doesn't exist yet, all collections at once"""
+    totals = {"existing": 0, "created": 0, "failed": 0}
+    results = await asyncio.gather(
+        *(_ensure_collection(db[name], models) for name, models in declared.items()),
+        return_exceptions=True
+    )
+    for name, result in zip(declared, results):
+        if isinstance(result, Exception):
+            totals["failed"] += len(declared[name])
+            logger.error(f"Failed to check indexes on {name}: {str(result)}")
+            continue
+        for key, count in result.items():
+            totals[key] += count
+    return totals
@@ -0,0 +1,93 @@
+"""MongoDB lease for running scheduled jobs on one worker at a time.
+
+Every uvicorn worker runs the same scheduler, but jobs wrapped with
+`MongoLease.only_leader` only do work in the process holding the lease. The
+holder renews it every `ttl_seconds / 3`; if it dies, the lease expires and
+the next worker to heartbeat takes over. A leader that fails to renew stops
+treating itself as leader before the lease can be granted to anyone else.
+"""
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+
+class MongoLease:
+    """A named, renewable lease stored as one document in `collection`"""
+
+    def __init__(self, collection, name: str, ttl_seconds: float = 30):
+        self.collection = collection
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._valid_until
+
+    async def try_acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if we hold it"""
+        # Measured before the round trip so our view never outlives the stored expiry
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"id": self.name, "$or": [{"holder": self.holder}, {"expires_at": {"$lte": now}}]},
+                {"$set": {
+                    "holder": self.holder,
+                    "expires_at": now + timedelta(seconds=self.ttl_seconds),
+                    "renewed_at": now
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Someone else holds an unexpired lease, so the upsert collided with it
+            self._valid_until = 0.0
+            return False
+        self._valid_until = started + self.ttl_seconds
+        return True
+
+    async def release(self):
+        """Give up the lease so another worker can take over without waiting for expiry"""
+        was_leader = self.is_leader
+        self._valid_until = 0.0
+        if was_leader:
+            await self.collection.delete_one({"id": self.name, "holder": self.holder})
+
+    async def run(self):
+        """Heartbeat loop: acquire or renew the lease until cancelled"""
+        indexed = False
+        while True:
+            was_leader = self.is_leader
+            try:
+                # The unique index is what makes competing upserts collide, so nobody
+                # takes the lease before it exists; retried here if Mongo is down at boot
+                if not indexed:
+                    await self.collection.create_index("id", unique=True)
+                    indexed = True
+                leader = await self.try_acquire()
+            except Exception as e:
+                # Keep whatever validity is left; it lapses on its own if Mongo stays unreachable
+                logger.error(f"Error renewing {self.name} lease: {str(e)}")
+                leader = self.is_leader
+            if leader != was_leader:
+                logger.info(f"{'Acquired' if leader else 'Lost'} {self.name} lease as {self.holder}")
+            await asyncio.sleep(self.ttl_seconds / 3)
+
+    def only_leader(self, job: Callable[[], Awaitable[None]]):
+        """Wrap a scheduled job so it is skipped on workers that don't hold the lease"""
+        @functools.wraps(job)
+        async def run_if_leader():
+            if self.is_leader:
+                await job()
+        return run_if_leader
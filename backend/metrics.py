@@ -0,0 +1,309 @@
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters, gauges and histograms here are plain Python objects guarded by a
+lock, since PyMongo calls command listeners from its own threads. Values are
+per worker process; Prometheus adds them up across workers when scraped.
+
+`MetricsMiddleware` records every HTTP request by route template (not raw
+path, to keep label cardinality bounded) and `MongoCommandMetrics` is a PyMongo
+command listener that times each database command per collection.
+"""
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+INF_BUCKET = 'le="+Inf"'
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(label) for label in labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in values]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, *labels, amount: float = 1.0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, *labels, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    samples = Counter.samples
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][index] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        """Observe the wall time of the enclosed block, including awaits"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, INF_BUCKET)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric; registering a name again returns the existing metric"""
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, latency, in-flight requests and payload sizes"""
+
+    def __init__(self, app, registry: Registry):
+        self.app = app
+        self.requests = registry.counter(
+            "http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+        self.latency = registry.histogram(
+            "http_request_duration_seconds", "HTTP request latency until the response is complete", ("method", "route"))
+        self.in_flight = registry.gauge(
+            "http_requests_in_flight", "HTTP requests currently being handled", ("method",))
+        self.request_size = registry.histogram(
+            "http_request_size_bytes", "HTTP request body size", ("method", "route"), buckets=SIZE_BUCKETS)
+        self.response_size = registry.histogram(
+            "http_response_size_bytes", "HTTP response body size", ("method", "route"), buckets=SIZE_BUCKETS)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        received = 0
+        sent = 0
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        self.in_flight.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            self.in_flight.dec(method)
+            # The router fills in the matched route; unmatched paths share one label
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            self.latency.observe(time.perf_counter() - started, method, route)
+            self.requests.inc(method, route, status)
+            self.request_size.observe(received, method, route)
+            self.response_size.observe(sent, method, route)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command per collection and logs slow ones"""
+
+    # Commands whose first value is the collection name
+    COLLECTION_COMMANDS = {
+        "find", "aggregate", "insert", "update", "delete", "findAndModify",
+        "count", "distinct", "createIndexes"
+    }
+
+    def __init__(self, registry: Registry, slow_ms: float = 100.0):
+        self.slow_ms = slow_ms
+        self.duration = registry.histogram(
+            "mongodb_command_duration_seconds", "MongoDB command latency", ("command", "collection"))
+        self.failures = registry.counter(
+            "mongodb_command_failures_total", "MongoDB commands that failed", ("command", "collection"))
+        self.documents = registry.histogram(
+            "mongodb_command_documents", "Documents returned or written per MongoDB command",
+            ("command", "collection"), buckets=COUNT_BUCKETS)
+        self.slow = registry.counter(
+            "mongodb_slow_commands_total", "MongoDB commands slower than the slow-query threshold",
+            ("command", "collection"))
+        self._pending: Dict[Tuple[int, object], Tuple[str, str, Mapping]] = {}
+        self._lock = threading.Lock()
+
+    def _collection(self, event) -> str:
+        command = event.command
+        if event.command_name == "getMore":
+            return str(command.get("collection", "unknown"))
+        if event.command_name in self.COLLECTION_COMMANDS:
+            return str(command.get(event.command_name, "unknown"))
+        return "none"
+
+    @staticmethod
+    def _summary(command) -> str:
+        """Short description of a command's filter for the slow-query log"""
+        for key in ("filter", "pipeline", "query", "updates", "deletes"):
+            if key in command:
+                return f"{key}={str(command[key])[:300]}"
+        return ""
+
+    def started(self, event):
+        # Keep a reference to the command; it is only summarized if it turns out slow
+        with self._lock:
+            self._pending[(event.request_id, event.connection_id)] = (
+                event.command_name, self._collection(event), event.command
+            )
+
+    def _finish(self, event):
+        with self._lock:
+            return self._pending.pop((event.request_id, event.connection_id), None)
+
+    def succeeded(self, event):
+        pending = self._finish(event)
+        if pending is None:
+            return
+        command, collection, body = pending
+        seconds = event.duration_micros / 1e6
+        self.duration.observe(seconds, command, collection)
+
+        reply = event.reply
+        cursor = reply.get("cursor")
+        if cursor is not None:
+            batch = cursor.get("firstBatch", cursor.get("nextBatch", []))
+            self.documents.observe(len(batch), command, collection)
+        elif "n" in reply:
+            self.documents.observe(reply["n"], command, collection)
+
+        if seconds * 1000 >= self.slow_ms:
+            self.slow.inc(command, collection)
+            logger.warning(f"Slow MongoDB {command} on {collection}: {seconds * 1000:.1f} ms {self._summary(body)}")
+
+    def failed(self, event):
+        pending = self._finish(event)
+        if pending is None:
+            return
+        command, collection, _ = pending
+        self.duration.observe(event.duration_micros / 1e6, command, collection)
+        self.failures.inc(command, collection)
@@ -0,0 +1,118 @@
+"""One-time migration of voucher expiry_date/created_at strings to native BSON dates.
+
+Usage (from the backend directory):
+    python migrate_dates.py [--batch-size 500] [--restart]
+
+The migration walks the vouchers collection in _id order and records its
+position in the `migrations` collection after every batch, so an interrupted
+run picks up where it stopped. Running it again after it finished is a no-op
+unless new string-dated documents were written in the meantime.
+
+The server's one-time reminder backfill skips vouchers whose expiry_date is
+still a string, so each converted voucher gets its next_reminder_at here.
+Converted dates change the wire JSON, so each batch also takes fresh
+change_seq numbers (Drive deltas) and bumps the voucher version (ETags).
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+from server import (
+    bump_voucher_version, client, current_reminder_days, db, next_change_seq, next_reminder_at, to_utc_datetime
+)
+
+MIGRATION_ID = "voucher_native_dates"
+DATE_FIELDS = ("expiry_date", "created_at")
+
+logger = logging.getLogger("migrate_dates")
+
+
+async def migrate_voucher_dates(batch_size: int = 500, restart: bool = False):
+    """Rewrite string dates on vouchers as BSON dates in resumable batches"""
+    if restart:
+        await db.migrations.delete_one({"id": MIGRATION_ID})
+
+    state = await db.migrations.find_one({"id": MIGRATION_ID}, {"_id": 0}) or {}
+    last_id = state.get("last_id")
+    converted = state.get("converted", 0)
+    failed = state.get("failed", 0)
+
+    string_dates = {"$or": [{field: {"$type": "string"}} for field in DATE_FIELDS]}
+    reminder_days = await current_reminder_days()
+
+    while True:
+        query = string_dates if last_id is None else {"$and": [string_dates, {"_id": {"$gt": last_id}}]}
+        batch = await db.vouchers.find(
+            query,
+            {"_id": 1, "id": 1, **{field: 1 for field in DATE_FIELDS}}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+
+        if not batch:
+            break
+
+        operations = []
+        for doc in batch:
+            update = {}
+            for field in DATE_FIELDS:
+                if not isinstance(doc.get(field), str):
+                    continue
+                try:
+                    update[field] = to_utc_datetime(doc[field])
+                except ValueError:
+                    failed += 1
+                    logger.warning(f"Voucher {doc.get('id')}: unparseable {field} {doc[field]!r}")
+            if "expiry_date" in update:
+                due_at = next_reminder_at(update["expiry_date"], reminder_days, datetime.now(timezone.utc))
+                if due_at is not None:
+                    update["next_reminder_at"] = due_at
+            if update:
+                operations.append((doc["_id"], update))
+
+        if operations:
+            last_seq = await next_change_seq(len(operations))
+            result = await db.vouchers.bulk_write([
+                UpdateOne({"_id": _id}, {"$set": {**update, "change_seq": last_seq - len(operations) + 1 + offset}})
+                for offset, (_id, update) in enumerate(operations)
+            ], ordered=False)
+            converted += result.modified_count
+            await bump_voucher_version()
+
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"id": MIGRATION_ID},
+            {"$set": {
+                "id": MIGRATION_ID,
+                "last_id": last_id,
+                "converted": converted,
+                "failed": failed,
+                "updated_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        logger.info(f"Migrated batch of {len(batch)} vouchers ({converted} converted, {failed} failed)")
+
+    await db.migrations.update_one(
+        {"id": MIGRATION_ID},
+        {"$set": {"id": MIGRATION_ID, "completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+    return {"converted": converted, "failed": failed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert voucher date strings to native BSON dates")
+    parser.add_argument("--batch-size", type=int, default=500, help="documents per bulk write")
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    result = asyncio.run(migrate_voucher_dates(batch_size=args.batch_size, restart=args.restart))
+    client.close()
+    logger.info(f"Migration finished: {result['converted']} converted, {result['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
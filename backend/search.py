@@ -0,0 +1,147 @@
+"""Normalized search fields and an in-process brand prefix index for voucher lookups.
+
+Vouchers carry lowercase, accent-free token arrays next to their display fields
+(`brand_key`, `location_terms`, `region_terms`). Lookups are anchored prefix
+matches on those arrays, which MongoDB answers from a multikey index instead of
+scanning every document with a case-insensitive regex.
+"""
+import bisect
+import logging
+import re
+import unicodedata
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from pymongo import UpdateOne
+
+SEARCH_FIELDS_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(text: Optional[str]) -> str:
+    """Lowercase, strip accents and collapse punctuation/whitespace to single spaces"""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"[^\W_]+", stripped.lower()))
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Split text into unique normalized tokens, keeping first-seen order"""
+    return list(dict.fromkeys(normalize(text).split()))
+
+
+def search_fields(voucher: dict) -> Dict[str, object]:
+    """Derived fields stored on each voucher document for indexed lookups"""
+    return {
+        "brand_key": normalize(voucher.get("brand_name")),
+        "location_terms": tokenize(voucher.get("store_location")),
+        "region_terms": tokenize(voucher.get("region")),
+        "search_version": SEARCH_FIELDS_VERSION
+    }
+
+
+def prefix_patterns(text: Optional[str]) -> List[re.Pattern]:
+    """Anchored, escaped prefix patterns for each token of user input"""
+    return [re.compile("^" + re.escape(token)) for token in tokenize(text)]
+
+
+class BrandPrefixIndex:
+    """Sorted in-memory index answering word-prefix queries over brand names.
+
+    Every word-aligned suffix of a brand key is stored, so "coff" finds
+    "starbucks coffee" as well as "coffee bean".
+    """
+
+    def __init__(self):
+        self._entries: List[tuple] = []
+        self._brands = set()
+
+    def __len__(self):
+        return len(self._brands)
+
+    def rebuild(self, brand_keys):
+        self._brands = set()
+        entries = []
+        for brand_key in brand_keys:
+            if not brand_key or brand_key in self._brands:
+                continue
+            self._brands.add(brand_key)
+            words = brand_key.split(" ")
+            entries.extend((" ".join(words[i:]), brand_key) for i in range(len(words)))
+        entries.sort()
+        self._entries = entries
+
+    def match(self, query: Optional[str], limit: int = 100) -> List[str]:
+        """Brand keys having a word-aligned suffix that starts with the query"""
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        matches = []
+        position = bisect.bisect_left(self._entries, (prefix,))
+        while position < len(self._entries) and len(matches) < limit:
+            suffix, brand_key = self._entries[position]
+            if not suffix.startswith(prefix):
+                break
+            if brand_key not in matches:
+                matches.append(brand_key)
+            position += 1
+        return matches
+
+
+def relevance(voucher: dict, region: Optional[str], store_name: Optional[str]) -> float:
+    """Score a nearby match: exact brand > brand prefix > location > region > international"""
+    store_key = normalize(store_name)
+    brand_key = voucher.get("brand_key") or normalize(voucher.get("brand_name"))
+
+    if voucher.get("store_type") == "specific" and store_key:
+        if brand_key == store_key:
+            return 4.0
+        if brand_key.startswith(store_key):
+            return 3.0
+        if (" " + brand_key).find(" " + store_key) >= 0:
+            return 2.5
+        return 2.0
+    if voucher.get("store_type") == "regional" and region:
+        region_key = normalize(voucher.get("region"))
+        return 1.5 if region_key == normalize(region) else 1.0
+    return 0.0
+
+
+async def backfill_search_fields(db, batch_size: int = 500):
+    """Populate search fields on vouchers written before they existed"""
+    marker = {"id": "voucher_search_fields", "version": SEARCH_FIELDS_VERSION}
+    if await db.migrations.find_one(marker):
+        return 0
+
+    updated = 0
+    last_id = None
+    while True:
+        query = {} if last_id is None else {"_id": {"$gt": last_id}}
+        batch = await db.vouchers.find(
+            query,
+            {"_id": 1, "brand_name": 1, "store_location": 1, "region": 1, "search_version": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        operations = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": search_fields(doc)})
+            for doc in batch
+            if doc.get("search_version") != SEARCH_FIELDS_VERSION
+        ]
+        if operations:
+            result = await db.vouchers.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+        last_id = batch[-1]["_id"]
+
+    await db.migrations.update_one(
+        {"id": "voucher_search_fields"},
+        {"$set": {**marker, "completed_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    if updated:
+        logger.info(f"Backfilled search fields on {updated} vouchers")
+    return updated
@@ -1,105 +1,284 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, BeforeValidator, ValidationError, model_validator
+from pydantic_core import to_json
+from typing import Any, Dict, List, Optional, Annotated
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import math
 import base64
-from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.interval import IntervalTrigger
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request as GoogleRequest
-from fastapi.responses import RedirectResponse
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
 import io
 import json as json_lib
+import asyncio
+import hashlib
+import importlib
+import zlib
+import time
+from bson import Binary
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import OperationFailure
+from PIL import Image, ImageOps
+from admission import AdmissionQueue, CircuitBreaker, Rejected, CircuitOpen, TokenBucketLimiter
+from indexes import ensure_indexes
+from leader import MongoLease
+from metrics import Registry, MetricsMiddleware, MongoCommandMetrics
+from singletons import SingletonCache, watch_collections
+from storage import MemoryVoucherRepository, MongoVoucherRepository
+from drive_sync import DriveSyncEngine, DriveServiceCache, BackupWriter, create_file, delete_file, upload_file, json_default
+from search import BrandPrefixIndex, normalize, search_fields, prefix_patterns, relevance
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env', override=False)
 
 # MongoDB connection
+# Per-process metrics, scraped from /api/metrics
+metrics_registry = Registry()
+mongo_metrics = MongoCommandMetrics(metrics_registry, slow_ms=float(os.environ.get('MONGO_SLOW_QUERY_MS', '100')))
+llm_call_seconds = metrics_registry.histogram(
+    "llm_scan_duration_seconds", "Vision model call latency", ("outcome",))
+drive_sync_seconds = metrics_registry.histogram(
+    "drive_sync_duration_seconds", "Google Drive backup duration", ("mode", "outcome"))
+scan_in_flight = metrics_registry.gauge(
+    "scan_admission_in_flight", "Scans holding or waiting for a model slot")
+llm_circuit_state = metrics_registry.gauge(
+    "llm_circuit_state", "Model circuit breaker state (0 closed, 1 half open, 2 open)")
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[mongo_metrics])
 db = client[os.environ['DB_NAME']]
 
+# Vouchers, pending reminders and settings (including Drive credentials and
+# sync status) go through a repository. With STORAGE_BACKEND=memory they live
+# in this process (run a single worker), persisted to STORAGE_PATH if set, and
+# nothing runs against MongoDB in the background; batch scan jobs are
+# unavailable and connecting Drive (OAuth state) still needs MongoDB.
+REMINDER_RETENTION_DAYS = 30
+TOMBSTONE_RETENTION_DAYS = 90
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+if STORAGE_BACKEND == 'memory':
+    repository = MemoryVoucherRepository(
+        timedelta(days=REMINDER_RETENTION_DAYS),
+        timedelta(days=TOMBSTONE_RETENTION_DAYS),
+        os.environ.get('STORAGE_PATH') or None
+    )
+elif STORAGE_BACKEND == 'mongo':
+    repository = MongoVoucherRepository(
+        db, timedelta(days=REMINDER_RETENTION_DAYS), timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    )
+else:
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}; use 'mongo' or 'memory'")
+USES_MONGO = STORAGE_BACKEND == 'mongo'
+
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
-# Initialize scheduler
-scheduler = AsyncIOScheduler()
+# Scheduler is created once APScheduler has been imported after startup;
+# shared jobs only run on the worker holding the lease
+scheduler = None
+scheduler_lease = MongoLease(db.leases, "scheduler", float(os.environ.get('SCHEDULER_LEASE_SECONDS', '30')))
+scheduler_lease_task = None
+
+# Blocking Google Drive calls run on the engine's own thread
+drive_engine = DriveSyncEngine()
+drive_service_cache = DriveServiceCache(drive_engine)
+
+# Singleton documents read on most requests, cached per process
+SINGLETON_CACHE_TTL_SECONDS = float(os.environ.get('SINGLETON_CACHE_TTL_SECONDS', '30'))
+reminder_settings_cache = SingletonCache(
+    "reminder_settings", lambda: repository.get_settings("reminder_settings"), SINGLETON_CACHE_TTL_SECONDS,
+    lambda doc: ReminderSettings(**doc)
+)
+drive_credentials_cache = SingletonCache(
+    "drive_credentials", lambda: repository.get_settings("drive_credentials"), SINGLETON_CACHE_TTL_SECONDS
+)
+sync_status_cache = SingletonCache(
+    "drive_sync", lambda: repository.get_settings("drive_sync"), SINGLETON_CACHE_TTL_SECONDS
+)
+singleton_watcher = None
+
+# In-process prefix index over normalized brand names for nearby lookups,
+# reloaded whenever any worker has written vouchers since it was built
+brand_index = BrandPrefixIndex()
+brand_index_version = None
+brand_index_lock = asyncio.Lock()
+NEARBY_LIMIT = 100
+
+async def refresh_brand_index():
+    """Rebuild the brand prefix index from the indexed brand_key values"""
+    global brand_index_version
+    try:
+        # Read before the brands, so a write in between triggers another rebuild
+        version = await voucher_version()
+        brand_index.rebuild(await repository.brand_keys())
+        brand_index_version = version
+    except Exception as e:
+        logger.error(f"Error refreshing brand index: {str(e)}")
+
+async def match_brand_keys(store_name: Optional[str]) -> List[str]:
+    """Brand keys matching a store name, reloading the index if vouchers changed"""
+    if not store_name:
+        return []
+    if await voucher_version() != brand_index_version:
+        # Single flight: concurrent lookups wait for one rebuild
+        async with brand_index_lock:
+            if await voucher_version() != brand_index_version:
+                await refresh_brand_index()
+    return brand_index.match(store_name)
+
+async def prepare_search_index():
+    """Backfill search fields on older vouchers, then load the brand index"""
+    try:
+        await repository.migrate()
+    except Exception as e:
+        logger.error(f"Error backfilling search fields: {str(e)}")
+    await refresh_brand_index()
+
+# Reminders: each voucher stores when its next reminder is due, so a check
+# only reads vouchers that are due instead of rescanning the whole window
+REMINDER_BATCH_SIZE = 500
+REMINDER_SCHEDULE_VERSION = 1
+REMINDER_CHECK_MINUTES = 15
+
+def next_reminder_at(expiry_date, reminder_days, now: datetime) -> Optional[datetime]:
+    """When the next reminder for a voucher is due, or None if there is none left.
+    
+    A reminder for d days fires while (expiry - now).days == d, i.e. during the
+    day-long window ending d days before expiry. A window that is open now is
+    due immediately; otherwise the next one is due when it opens.
+    """
+    if not isinstance(expiry_date, datetime) or not reminder_days:
+        return None
+    days_left = (expiry_date - now).days
+    if days_left > 0 and days_left in reminder_days:
+        return now
+    upcoming = [days for days in reminder_days if 0 < days < days_left]
+    if not upcoming:
+        return None
+    # (expiry - t).days only drops to d just after expiry - (d + 1) days
+    return expiry_date - timedelta(days=max(upcoming) + 1) + timedelta(milliseconds=1)
+
+async def current_reminder_days() -> List[int]:
+    """Configured reminder days; nothing is scheduled until settings are saved"""
+    settings = await reminder_settings_cache.get()
+    if not settings:
+        return []
+    return settings.reminder_days
+
+async def reschedule_reminders(reminder_days: List[int]):
+    """Recompute next_reminder_at for every unexpired voucher (after settings change)"""
+    now = datetime.now(timezone.utc)
+    last_id = None
+    while True:
+        batch = await repository.unexpired_vouchers(now, last_id, REMINDER_BATCH_SIZE)
+        if not batch:
+            break
+        await repository.set_reminder_schedule({
+            voucher["id"]: next_reminder_at(voucher["expiry_date"], reminder_days, now)
+            for voucher in batch
+        })
+        last_id = batch[-1]["id"]
+        # The memory backend never waits on I/O, so let requests run between batches
+        await asyncio.sleep(0)
+
+async def prepare_reminder_schedule():
+    """Schedule reminders once for vouchers created before next_reminder_at existed"""
+    try:
+        if await repository.migration_done("voucher_reminder_schedule", REMINDER_SCHEDULE_VERSION):
+            return
+        await reschedule_reminders(await current_reminder_days())
+        await repository.record_migration("voucher_reminder_schedule", REMINDER_SCHEDULE_VERSION)
+    except Exception as e:
+        logger.error(f"Error scheduling reminders: {str(e)}")
 
-# Function to check and send reminders
 async def check_and_send_reminders():
-    """Check for expiring vouchers and send reminders"""
+    """Queue reminders for vouchers whose next reminder is due"""
     try:
         # Get reminder settings
-        settings_doc = await db.reminder_settings.find_one({"id": "reminder_settings"}, {"_id": 0})
-        if not settings_doc:
+        settings = await reminder_settings_cache.get()
+        if not settings:
             return
         
-        settings = ReminderSettings(**settings_doc)
-        
-        # Calculate date range for query optimization
-        current_date = datetime.now(timezone.utc)
-        max_days = max(settings.reminder_days) if settings.reminder_days else 7
-        threshold_date = current_date + timedelta(days=max_days)
+        now = datetime.now(timezone.utc)
+        queued = 0
         
-        # Optimized query - only fetch vouchers expiring within reminder window
-        vouchers = await db.vouchers.find({
-            "expiry_date": {
-                "$gte": current_date.isoformat(),
-                "$lte": threshold_date.isoformat()
-            }
-        }, {"_id": 0}).limit(500).to_list(500)
-        
-        reminders_to_send = []
-        
-        for voucher in vouchers:
-            try:
-                expiry_date = datetime.fromisoformat(voucher['expiry_date'])
-                days_until_expiry = (expiry_date - current_date).days
-                
-                # Check if we should send a reminder
-                if days_until_expiry in settings.reminder_days and days_until_expiry > 0:
-                    reminders_to_send.append({
-                        'voucher': voucher,
-                        'days_left': days_until_expiry
-                    })
-            except:
-                pass
+        # Every processed voucher moves its next_reminder_at past now (or drops it),
+        # so each batch re-reads from the start of the due set until it's empty
+        while True:
+            vouchers = await repository.due_vouchers(now, REMINDER_BATCH_SIZE)
+            if not vouchers:
+                break
+            
+            reminders = []
+            schedule = {}
+            for voucher in vouchers:
+                expiry_date = voucher.get("expiry_date")
+                remaining_days = settings.reminder_days
+                if isinstance(expiry_date, datetime):
+                    days_left = (expiry_date - now).days
+                    if days_left > 0 and days_left in settings.reminder_days:
+                        # Queued once per (voucher_id, days_left): re-running a check never duplicates
+                        reminders.append({
+                            "id": str(uuid.uuid4()),
+                            "voucher_id": voucher["id"],
+                            "brand_name": voucher["brand_name"],
+                            "days_left": days_left,
+                            "created_at": now
+                        })
+                        # This window is handled; schedule the next one
+                        remaining_days = [days for days in remaining_days if days < days_left]
+                schedule[voucher["id"]] = next_reminder_at(expiry_date, remaining_days, now)
+            
+            queued += await repository.queue_reminders(reminders)
+            await repository.set_reminder_schedule(schedule)
         
         # Log reminders (in production, this would send emails/push notifications)
-        if reminders_to_send:
-            logger.info(f"Found {len(reminders_to_send)} vouchers expiring soon")
-            
-            # Store reminders in database for browser to fetch
-            for reminder in reminders_to_send:
-                await db.pending_reminders.insert_one({
-                    "voucher_id": reminder['voucher']['id'],
-                    "brand_name": reminder['voucher']['brand_name'],
-                    "days_left": reminder['days_left'],
-                    "created_at": datetime.now(timezone.utc).isoformat()
-                })
+        if queued:
+            logger.info(f"Queued {queued} reminders for vouchers expiring soon")
         
         # Update last check time
-        await db.reminder_settings.update_one(
-            {"id": "reminder_settings"},
-            {"$set": {"last_check": datetime.now(timezone.utc).isoformat()}},
-            upsert=True
-        )
+        await repository.update_settings("reminder_settings", {"last_check": now})
+        reminder_settings_cache.invalidate()
         
     except Exception as e:
         logger.error(f"Error checking reminders: {str(e)}")
 
+def to_utc_datetime(value):
+    """Coerce a date, datetime or ISO 8601 string into an aware UTC datetime"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+    return value
+
+# Dates are stored as native BSON dates in UTC; YYYY-MM-DD input means midnight UTC
+UTCDateTime = Annotated[datetime, BeforeValidator(to_utc_datetime)]
+
+Latitude = Annotated[float, Field(ge=-90, le=90)]
+Longitude = Annotated[float, Field(ge=-180, le=180)]
+
+def geo_point(latitude: float, longitude: float) -> dict:
+    """GeoJSON point for the 2dsphere index (longitude first)"""
+    return {"type": "Point", "coordinates": [longitude, latitude]}
+
+class CoordinatesMixin:
+    @model_validator(mode="after")
+    def check_coordinates(self):
+        if (self.latitude is None) != (self.longitude is None):
+            raise ValueError("latitude and longitude must be provided together")
+        return self
+
 # Models
 class Voucher(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -110,32 +289,44 @@ class Voucher(BaseModel):
     discount_value: Optional[str] = None
     currency: str = "USD"
     voucher_code: str
-    expiry_date: str
+    expiry_date: UTCDateTime
     store_type: str = "international"  # specific, regional, international
     redemption_type: str = "both"  # online, offline, both
     store_location: Optional[str] = None
     region: Optional[str] = None
     category: Optional[str] = None
     description: Optional[str] = None
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    latitude: Optional[Latitude] = None
+    longitude: Optional[Longitude] = None
+    created_at: UTCDateTime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-class VoucherCreate(BaseModel):
+class VoucherCreate(CoordinatesMixin, BaseModel):
     brand_name: str
     discount_amount: str
     discount_value: Optional[str] = None
     currency: str = "USD"
     voucher_code: str
-    expiry_date: str
+    expiry_date: UTCDateTime
     store_type: str = "international"
     redemption_type: str = "both"
     store_location: Optional[str] = None
     region: Optional[str] = None
     category: Optional[str] = None
     description: Optional[str] = None
+    latitude: Optional[Latitude] = None
+    longitude: Optional[Longitude] = None
 
-class LocationCheckIn(BaseModel):
+class VoucherImport(VoucherCreate):
+    # Exports carry these, so a restore keeps ids and creation times
+    id: Optional[str] = None
+    created_at: Optional[UTCDateTime] = None
+
+class LocationCheckIn(CoordinatesMixin, BaseModel):
     region: Optional[str] = None
     store_name: Optional[str] = None
+    latitude: Optional[Latitude] = None
+    longitude: Optional[Longitude] = None
+    radius_km: float = Field(default=5.0, gt=0, le=100)
 
 class ImageScanRequest(BaseModel):
     image_base64: str
@@ -158,203 +349,1049 @@ class ReminderSettingsUpdate(BaseModel):
     reminder_days: List[int]
     default_currency: str
 
+# Pagination
+MAX_PAGE_SIZE = 500
+# Widest expiring-soon window, in days; larger values overflow date arithmetic
+MAX_EXPIRING_DAYS = 3650
+
+# List endpoints read only the fields a Voucher exposes and serialize them
+# straight to JSON, skipping per-row model validation; their response_model
+# still documents the schema
+VOUCHER_WIRE_FIELDS = tuple(
+    (name, None if field.default_factory else field.default)
+    for name, field in Voucher.model_fields.items()
+)
+VOUCHER_WIRE_FIELD_NAMES = tuple(name for name, _ in VOUCHER_WIRE_FIELDS)
+
+def voucher_list_json(vouchers: List[dict]) -> bytes:
+    """JSON array of stored vouchers in their wire format"""
+    return to_json([
+        {name: voucher.get(name, default) for name, default in VOUCHER_WIRE_FIELDS}
+        for voucher in vouchers
+    ])
+
+def voucher_list_response(vouchers: List[dict], response: Response) -> Response:
+    """JSON response for stored vouchers, carrying headers already set on response"""
+    return Response(content=voucher_list_json(vouchers), media_type="application/json", headers=dict(response.headers))
+
+def encode_cursor(sort_value, voucher_id: str) -> str:
+    """Encode the sort key of the last voucher on a page as an opaque cursor"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    payload = json_lib.dumps([sort_value, voucher_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Decode a cursor produced by encode_cursor into (sort_value, id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, voucher_id = json_lib.loads(base64.urlsafe_b64decode(padded))
+        if not isinstance(sort_value, str) or not isinstance(voucher_id, str):
+            raise ValueError("malformed cursor")
+        return to_utc_datetime(sort_value), voucher_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Change tracking: every voucher write takes a number from one global sequence,
+# and deletes leave a tombstone, so backups can ship only what changed
+async def next_change_seq(count: int = 1) -> int:
+    """Reserve count change sequence numbers; returns the highest one"""
+    return await repository.next_sequence("voucher_changes", count)
+
+async def current_change_seq() -> int:
+    return await repository.current_sequence("voucher_changes")
+
+# Conditional GETs: list responses are tagged with a version bumped after every
+# voucher write. Reading it before the query and bumping it after the write
+# means a response can only ever be tagged older than its data, never newer.
+async def voucher_version() -> int:
+    return await repository.current_sequence("voucher_version")
+
+async def bump_voucher_version() -> int:
+    return await repository.next_sequence("voucher_version")
+
+def not_modified(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Tag the response; returns a 304 if the client already holds this version"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    response.headers.update(headers)
+    tags = [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]
+    if "*" in tags or etag in tags or f"W/{etag}" in tags:
+        return Response(status_code=304, headers=headers)
+    return None
+
+# Stats
+EXPIRING_SOON_DAYS = 7
+
+def stats_bucket(expiry_date: datetime, now: datetime) -> str:
+    """Which stats bucket a voucher falls into at the given moment"""
+    if expiry_date < now:
+        return "expired"
+    if expiry_date <= now + timedelta(days=EXPIRING_SOON_DAYS):
+        return "expiring_soon"
+    return "active"
+
+def next_stats_boundary(expiry_date: datetime, now: datetime) -> Optional[datetime]:
+    """When a voucher next moves to another bucket, or None once expired"""
+    if expiry_date > now + timedelta(days=EXPIRING_SOON_DAYS):
+        return expiry_date - timedelta(days=EXPIRING_SOON_DAYS)
+    if expiry_date >= now:
+        return expiry_date
+    return None
+
+async def compute_voucher_stats(now: datetime):
+    """Aggregate voucher stats and the moment they next go stale"""
+    result = await repository.voucher_stats(now, now + timedelta(days=EXPIRING_SOON_DAYS))
+    stats = {
+        "total": result["total"],
+        "active": result["active"],
+        "expired": result["expired"],
+        "expiring_soon": result["total"] - result["active"] - result["expired"],
+        "by_category": {
+            category or "uncategorized": count for category, count in result["by_category"].items()
+        },
+        "by_currency": {
+            currency or "unknown": count for currency, count in result["by_currency"].items()
+        }
+    }
+    
+    boundaries = [
+        next_stats_boundary(expiry_date, now)
+        for expiry_date in (result["next_expired"], result["next_expiring_soon"])
+        if expiry_date is not None
+    ]
+    return stats, min([b for b in boundaries if b is not None], default=None)
+
+class VoucherStatsCache:
+    """Voucher stats kept in memory and adjusted in place on writes.
+
+    Counts stay exact until the next expiry boundary, when some voucher moves
+    from active to expiring soon or from expiring soon to expired. The cache
+    remembers the voucher version it reflects, so a write by another worker
+    triggers a recompute on the next read.
+    """
+    
+    def __init__(self):
+        self._stats = None
+        self._valid_until = None
+        self._version = None
+        self._writes = 0
+        self._lock = asyncio.Lock()
+    
+    def _fresh(self, now: datetime, version: int) -> bool:
+        return (
+            self._stats is not None
+            and version == self._version
+            and (self._valid_until is None or now < self._valid_until)
+        )
+    
+    def invalidate(self):
+        self._writes += 1
+        self._stats = None
+    
+    async def get(self):
+        if self._fresh(datetime.now(timezone.utc), await voucher_version()):
+            return self._stats
+        
+        # Single flight: concurrent readers wait for one recompute
+        async with self._lock:
+            now = datetime.now(timezone.utc)
+            # Read before the aggregation, so a write in between triggers another recompute
+            version = await voucher_version()
+            if self._fresh(now, version):
+                return self._stats
+            writes = self._writes
+            stats, boundary = await compute_voucher_stats(now)
+            # A write that raced the aggregation leaves the cache empty
+            if writes == self._writes:
+                self._stats = stats
+                self._valid_until = boundary
+                self._version = version
+            return stats
+    
+    def advance(self, version: int):
+        """Record a version bump for writes already applied to the cached counts"""
+        if self._stats is not None and version == self._version + 1:
+            self._version = version
+        else:
+            # Another worker wrote in between; recount rather than guess
+            self.invalidate()
+    
+    def apply(self, voucher: dict, delta: int):
+        """Adjust cached counts for a created (+1) or deleted (-1) voucher"""
+        self._writes += 1
+        if self._stats is None:
+            return
+        
+        # Legacy vouchers can keep an unparseable expiry_date string; recount
+        if not isinstance(voucher.get('expiry_date'), datetime):
+            self.invalidate()
+            return
+        
+        now = datetime.now(timezone.utc)
+        expiry_date = to_utc_datetime(voucher['expiry_date'])
+        self._stats["total"] += delta
+        self._stats[stats_bucket(expiry_date, now)] += delta
+        for key, value in (
+            ("by_category", voucher.get('category') or "uncategorized"),
+            ("by_currency", voucher.get('currency') or "unknown")
+        ):
+            count = self._stats[key].get(value, 0) + delta
+            if count > 0:
+                self._stats[key][value] = count
+            else:
+                self._stats[key].pop(value, None)
+        
+        boundary = next_stats_boundary(expiry_date, now)
+        if delta > 0 and boundary and (self._valid_until is None or boundary < self._valid_until):
+            self._valid_until = boundary
+
+stats_cache = VoucherStatsCache()
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Voucher Management API"}
 
+def voucher_document(voucher_obj: Voucher, reminder_days: List[int]) -> dict:
+    """MongoDB document for a voucher, including derived search, geo and reminder fields"""
+    doc = voucher_obj.model_dump()
+    doc.update(search_fields(doc))
+    if voucher_obj.latitude is not None:
+        doc['geo'] = geo_point(voucher_obj.latitude, voucher_obj.longitude)
+    due_at = next_reminder_at(voucher_obj.expiry_date, reminder_days, datetime.now(timezone.utc))
+    if due_at is not None:
+        doc['next_reminder_at'] = due_at
+    return doc
+
 @api_router.post("/vouchers", response_model=Voucher)
 async def create_voucher(voucher_input: VoucherCreate):
     voucher_dict = voucher_input.model_dump()
     voucher_obj = Voucher(**voucher_dict)
     
-    doc = voucher_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    doc = voucher_document(voucher_obj, await current_reminder_days())
+    doc['change_seq'] = await next_change_seq()
     
-    await db.vouchers.insert_one(doc)
+    failures = await repository.insert_vouchers([doc])
+    if failures:
+        raise HTTPException(status_code=409, detail=failures[0])
+    version = await bump_voucher_version()
+    stats_cache.apply(doc, 1)
+    stats_cache.advance(version)
     return voucher_obj
 
 @api_router.get("/vouchers", response_model=List[Voucher])
-async def get_vouchers(skip: int = 0, limit: int = 100):
-    """Get vouchers with pagination"""
-    vouchers = await db.vouchers.find({}, {"_id": 0}).skip(skip).limit(limit).to_list(limit)
+async def get_vouchers(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    category: Optional[str] = None,
+    store_type: Optional[str] = None,
+    region: Optional[str] = None,
+    expiring_before: Optional[date] = None
+):
+    """Get vouchers newest first using keyset pagination on (created_at, id)"""
+    cached = not_modified(request, response, f'"v{await voucher_version()}"')
+    if cached:
+        return cached
+    
+    # Resume strictly after the last (created_at, id) pair of the previous page
+    after = decode_cursor(cursor) if cursor else None
+    
+    # Fetch one extra document to know whether another page exists
+    vouchers = await repository.list_vouchers(
+        limit + 1,
+        category=category or None,
+        store_type=store_type or None,
+        region=region or None,
+        expiring_before=to_utc_datetime(expiring_before) if expiring_before else None,
+        after=after,
+        fields=VOUCHER_WIRE_FIELD_NAMES
+    )
     
-    for voucher in vouchers:
-        if isinstance(voucher.get('created_at'), str):
-            voucher['created_at'] = datetime.fromisoformat(voucher['created_at'])
+    if len(vouchers) > limit:
+        vouchers = vouchers[:limit]
+        last = vouchers[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last['created_at'], last['id'])
     
-    return vouchers
+    return voucher_list_response(vouchers, response)
 
 @api_router.get("/vouchers/expiring-soon", response_model=List[Voucher])
-async def get_expiring_vouchers(days: int = 7):
-    """Get vouchers expiring within specified days"""
-    vouchers = await db.vouchers.find({}, {"_id": 0}).to_list(1000)
-    
-    current_date = datetime.now(timezone.utc)
-    threshold_date = current_date + timedelta(days=days)
+async def get_expiring_vouchers(
+    request: Request,
+    response: Response,
+    days: int = Query(7, ge=0, le=MAX_EXPIRING_DAYS),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Get vouchers expiring within specified days, soonest first"""
+    # Same window as the expiring_soon stats bucket: not yet expired, due within `days`
+    now = datetime.now(timezone.utc)
+    vouchers = await repository.expiring_vouchers(
+        now,
+        now + timedelta(days=days),
+        limit + 1,
+        after=decode_cursor(cursor) if cursor else None,
+        fields=VOUCHER_WIRE_FIELD_NAMES
+    )
     
-    expiring_vouchers = []
-    for voucher in vouchers:
-        if isinstance(voucher.get('created_at'), str):
-            voucher['created_at'] = datetime.fromisoformat(voucher['created_at'])
-        
-        try:
-            expiry_date = datetime.fromisoformat(voucher['expiry_date'])
-            if current_date <= expiry_date <= threshold_date:
-                expiring_vouchers.append(voucher)
-        except:
-            pass
+    if len(vouchers) > limit:
+        vouchers = vouchers[:limit]
+        last = vouchers[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last['expiry_date'], last['id'])
     
-    return expiring_vouchers
+    # The window moves with the clock, so tag the content itself
+    body = voucher_list_json(vouchers)
+    cached = not_modified(request, response, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+    if cached:
+        return cached
+    return Response(content=body, media_type="application/json", headers=dict(response.headers))
 
 @api_router.post("/vouchers/nearby", response_model=List[Voucher])
-async def get_nearby_vouchers(location: LocationCheckIn):
-    """Get vouchers based on region or store name using optimized queries"""
-    matching_vouchers = []
+async def get_nearby_vouchers(location: LocationCheckIn, response: Response):
+    """Get vouchers for a position, region or store, best matches first"""
+    vouchers = []
     
-    # Build query based on location
-    queries = [{"store_type": "international"}]
+    # Closest specific/regional vouchers within the radius come first
+    if location.latitude is not None:
+        vouchers = await repository.vouchers_near(
+            location.latitude,
+            location.longitude,
+            location.radius_km * 1000,
+            ["specific", "regional"],
+            NEARBY_LIMIT,
+            fields=VOUCHER_WIRE_FIELD_NAMES
+        )
     
-    if location.region:
-        queries.append({
-            "store_type": "regional",
-            "region": {"$regex": location.region, "$options": "i"}
-        })
+    # Prefix matches on the normalized region, brand and location tokens
+    region_patterns = prefix_patterns(location.region)
+    brand_keys = await match_brand_keys(location.store_name)
+    location_patterns = prefix_patterns(location.store_name)
     
-    if location.store_name:
-        queries.append({
-            "store_type": "specific",
-            "$or": [
-                {"brand_name": {"$regex": location.store_name, "$options": "i"}},
-                {"store_location": {"$regex": location.store_name, "$options": "i"}}
-            ]
-        })
+    # Queried in relevance tiers, so weak matches never crowd out the exact brand
+    store_key = normalize(location.store_name)
+    tiers = (
+        ([], [key for key in brand_keys if key == store_key], []),
+        ([], [key for key in brand_keys if key != store_key], []),
+        ([], [], location_patterns),
+        (region_patterns, [], [])
+    )
+    text_matches = []
+    for tier_regions, tier_brands, tier_locations in tiers:
+        remaining = NEARBY_LIMIT - len(vouchers) - len(text_matches)
+        if remaining <= 0:
+            break
+        if not (tier_regions or tier_brands or tier_locations):
+            continue
+        text_matches.extend(await repository.match_vouchers(
+            tier_regions,
+            tier_brands,
+            tier_locations,
+            [voucher['id'] for voucher in vouchers + text_matches],
+            remaining,
+            fields=VOUCHER_WIRE_FIELD_NAMES + ("brand_key",)
+        ))
+    text_matches.sort(key=lambda v: (
+        -relevance(v, location.region, location.store_name),
+        v['expiry_date']
+    ))
+    vouchers.extend(text_matches)
     
-    # Execute single query with $or
-    vouchers = await db.vouchers.find(
-        {"$or": queries},
-        {"_id": 0}
-    ).limit(100).to_list(100)
+    # International vouchers apply everywhere and fill the remaining slots
+    remaining = NEARBY_LIMIT - len(vouchers)
+    if remaining > 0:
+        vouchers.extend(await repository.vouchers_by_store_type(
+            "international", remaining, fields=VOUCHER_WIRE_FIELD_NAMES
+        ))
     
-    for voucher in vouchers:
-        if isinstance(voucher.get('created_at'), str):
-            voucher['created_at'] = datetime.fromisoformat(voucher['created_at'])
-        matching_vouchers.append(voucher)
+    return voucher_list_response(vouchers, response)
+
+# Multi-select create/delete; each batch is a single database round trip
+BULK_MAX_ITEMS = 1000
+BULK_BATCH_SIZE = 500
+
+class BulkDeleteRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+
+@api_router.post("/vouchers/bulk")
+async def bulk_create_vouchers(items: List[Dict[str, Any]]):
+    """Create many vouchers at once; invalid items are reported without failing the rest"""
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} vouchers per request")
+    
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            voucher_input = VoucherCreate.model_validate(item)
+        except ValidationError as e:
+            results[index] = {"index": index, "status": "error", "error": validation_message(e)}
+            continue
+        valid.append((index, Voucher(**voucher_input.model_dump())))
+    
+    for start in range(0, len(valid), BULK_BATCH_SIZE):
+        batch = valid[start:start + BULK_BATCH_SIZE]
+        failures = await insert_voucher_batch([voucher_obj for _, voucher_obj in batch])
+        for position, (index, voucher_obj) in enumerate(batch):
+            if position in failures:
+                results[index] = {"index": index, "status": "error", "error": failures[position]}
+                continue
+            stats_cache.apply(voucher_obj.model_dump(), 1)
+            results[index] = {"index": index, "status": "created", "voucher": voucher_obj}
     
-    return matching_vouchers
+    created = sum(1 for result in results if result["status"] == "created")
+    if created:
+        stats_cache.advance(await bump_voucher_version())
+    return {
+        "created": created,
+        "failed": len(items) - created,
+        "results": results
+    }
+
+@api_router.delete("/vouchers/bulk")
+async def bulk_delete_vouchers(request: BulkDeleteRequest):
+    """Delete many vouchers by id; ids that don't exist are reported as not_found"""
+    ids = list(dict.fromkeys(request.ids))
+    deleted_ids = set()
+    
+    for start in range(0, len(ids), BULK_BATCH_SIZE):
+        batch = ids[start:start + BULK_BATCH_SIZE]
+        found, deleted_all = await repository.delete_vouchers(batch)
+        if not found:
+            continue
+        
+        last_seq = await next_change_seq(len(found))
+        deleted_at = datetime.now(timezone.utc)
+        await repository.add_tombstones([
+            {"id": voucher["id"], "change_seq": last_seq - len(found) + 1 + offset, "deleted_at": deleted_at}
+            for offset, voucher in enumerate(found)
+        ])
+        version = await bump_voucher_version()
+        deleted_ids.update(voucher["id"] for voucher in found)
+        
+        if deleted_all:
+            for voucher in found:
+                stats_cache.apply(voucher, -1)
+            stats_cache.advance(version)
+        else:
+            # A concurrent delete got some of them first; recount rather than guess
+            stats_cache.invalidate()
+    
+    return {
+        "deleted": len(deleted_ids),
+        "not_found": len(ids) - len(deleted_ids),
+        "results": [
+            {"id": voucher_id, "status": "deleted" if voucher_id in deleted_ids else "not_found"}
+            for voucher_id in ids
+        ]
+    }
 
 @api_router.delete("/vouchers/{voucher_id}")
 async def delete_voucher(voucher_id: str):
-    result = await db.vouchers.delete_one({"id": voucher_id})
+    deleted = await repository.delete_voucher(voucher_id)
     
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Voucher not found")
     
+    await repository.add_tombstones([{
+        "id": voucher_id,
+        "change_seq": await next_change_seq(),
+        "deleted_at": datetime.now(timezone.utc)
+    }])
+    version = await bump_voucher_version()
+    stats_cache.apply(deleted, -1)
+    stats_cache.advance(version)
     return {"message": "Voucher deleted successfully"}
 
+# Bulk export/import as NDJSON (one voucher per line), gzip-compressed by default
+IMPORT_BATCH_SIZE = 500
+IMPORT_MAX_LINE_BYTES = 1024 * 1024
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+@api_router.get("/vouchers/export")
+async def export_vouchers(compress: bool = True):
+    """Stream every voucher as NDJSON (gzip unless compress=false) with constant memory"""
+    async def generate():
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        
+        def encode(lines):
+            data = "".join(lines).encode('utf-8')
+            return compressor.compress(data) if compressor else data
+        
+        lines = []
+        async for voucher in repository.iter_vouchers(VOUCHER_BACKUP_EXCLUDE):
+            lines.append(json_lib.dumps(voucher, separators=(",", ":"), default=json_default) + "\n")
+            if len(lines) >= IMPORT_BATCH_SIZE:
+                yield encode(lines)
+                lines = []
+        if lines:
+            yield encode(lines)
+        if compressor:
+            yield compressor.flush()
+    
+    filename = "vouchers.ndjson.gz" if compress else "vouchers.ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+async def iter_upload_lines(request: Request):
+    """Yield raw lines from a plain or gzip request body as it streams in"""
+    decompressor = None
+    started = False
+    buffer = b""
+    
+    def split(data):
+        nonlocal buffer
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail="Import line too long")
+        return lines
+    
+    async for chunk in request.stream():
+        if not chunk:
+            continue
+        if not started:
+            started = True
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(wbits=31)
+        if decompressor is None:
+            for line in split(chunk):
+                yield line
+            continue
+        # Inflate in bounded steps so a small compressed chunk can't balloon in memory
+        data = decompressor.decompress(chunk, IMPORT_MAX_LINE_BYTES)
+        while True:
+            for line in split(data):
+                yield line
+            if not decompressor.unconsumed_tail:
+                break
+            data = decompressor.decompress(decompressor.unconsumed_tail, IMPORT_MAX_LINE_BYTES)
+    
+    if decompressor is not None:
+        for line in split(decompressor.flush()):
+            yield line
+    if buffer.strip():
+        yield buffer
+
+def validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in detail['loc'])}: {detail['msg']}" if detail['loc'] else detail['msg']
+        for detail in error.errors()
+    )
+
+async def insert_voucher_batch(vouchers: List[Voucher]) -> Dict[int, str]:
+    """Insert vouchers in one repository write; returns error messages by position"""
+    reminder_days = await current_reminder_days()
+    docs = [voucher_document(voucher_obj, reminder_days) for voucher_obj in vouchers]
+    last_seq = await next_change_seq(len(docs))
+    for offset, doc in enumerate(docs):
+        doc['change_seq'] = last_seq - len(docs) + 1 + offset
+    
+    return await repository.insert_vouchers(docs)
+
+@api_router.post("/vouchers/import")
+async def import_vouchers(request: Request):
+    """Import NDJSON vouchers (plain or gzip) streamed in the request body.
+    
+    Rows are validated against VoucherCreate and written in batches;
+    invalid or duplicate rows are reported by line.
+    """
+    inserted = 0
+    errors = []
+    error_count = 0
+    rows = []
+    line_number = 0
+    
+    def record_error(line, message):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+            errors.append({"line": line, "error": message})
+    
+    async def flush():
+        nonlocal inserted, rows
+        if not rows:
+            return
+        failures = await insert_voucher_batch([voucher_obj for _, voucher_obj in rows])
+        inserted += len(rows) - len(failures)
+        for index, message in sorted(failures.items()):
+            record_error(rows[index][0], message)
+        rows = []
+    
+    async for line in iter_upload_lines(request):
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            voucher_input = VoucherImport.model_validate_json(line)
+        except ValidationError as e:
+            record_error(line_number, validation_message(e))
+            continue
+        
+        fields = voucher_input.model_dump(exclude_none=True)
+        rows.append((line_number, Voucher(**fields)))
+        if len(rows) >= IMPORT_BATCH_SIZE:
+            await flush()
+    await flush()
+    
+    if inserted:
+        await bump_voucher_version()
+        stats_cache.invalidate()
+    
+    return {
+        "inserted": inserted,
+        "failed": error_count,
+        "errors": errors
+    }
+
 @api_router.get("/vouchers/stats")
-async def get_voucher_stats():
-    """Get statistics about vouchers using aggregation"""
-    current_date = datetime.now(timezone.utc).isoformat()
-    threshold_date = (datetime.now(timezone.utc) + timedelta(days=7)).isoformat()
+async def get_voucher_stats(request: Request, response: Response):
+    """Get statistics about vouchers from the in-memory stats cache"""
+    stats = await stats_cache.get()
+    # Stats also change as vouchers cross expiry boundaries, so tag the content itself
+    digest = hashlib.sha256(json_lib.dumps(stats, sort_keys=True).encode('utf-8')).hexdigest()[:32]
+    cached = not_modified(request, response, f'"{digest}"')
+    if cached:
+        return cached
+    return stats
+
+# Scan results keyed by a hash of the decoded image bytes
+scan_cache = TTLCache(
+    maxsize=int(os.environ.get('SCAN_CACHE_SIZE', '256')),
+    ttl=int(os.environ.get('SCAN_CACHE_TTL_SECONDS', '86400'))
+)
+scan_inflight = {}
+
+# Admission control in front of the LLM client
+llm_admission = AdmissionQueue(
+    concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '4')),
+    max_queue=int(os.environ.get('LLM_MAX_QUEUE', '16'))
+)
+llm_breaker = CircuitBreaker(
+    failure_threshold=int(os.environ.get('LLM_BREAKER_THRESHOLD', '5')),
+    reset_seconds=float(os.environ.get('LLM_BREAKER_RESET_SECONDS', '30'))
+)
+scan_rate_limiter = TokenBucketLimiter(
+    rate_per_minute=float(os.environ.get('SCAN_RATE_PER_MINUTE', '20')),
+    burst=int(os.environ.get('SCAN_RATE_BURST', '10'))
+)
+
+def client_key(request: Request) -> str:
+    """Identify the caller for rate limiting, honouring the proxy's X-Forwarded-For"""
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        # Clients can send any X-Forwarded-For; only the hop our proxy appended is trustworthy
+        return forwarded.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+def rejection_error(e: Rejected) -> HTTPException:
+    status_code = 503 if isinstance(e, CircuitOpen) else 429
+    return HTTPException(
+        status_code=status_code,
+        detail=e.reason,
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+# Image decoding and resizing is CPU-bound, so it runs off the event loop
+SCAN_MAX_DIMENSION = int(os.environ.get('SCAN_MAX_DIMENSION', '1568'))
+SCAN_JPEG_QUALITY = int(os.environ.get('SCAN_JPEG_QUALITY', '85'))
+image_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('SCAN_IMAGE_WORKERS', '2')),
+    thread_name_prefix="scan-image"
+)
+
+def decode_image(image_base64: str):
+    """Decode an upload once; returns (bytes, SHA-256) so re-encoded uploads share a key"""
+    image_bytes = base64.b64decode("".join(image_base64.split()), validate=True)
+    return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+
+def preprocess_scan_image(image_bytes: bytes) -> str:
+    """Upright, downscale and re-encode an image as compact base64 JPEG"""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Let the JPEG decoder skip detail we are about to throw away
+            image.draft("RGB", (SCAN_MAX_DIMENSION, SCAN_MAX_DIMENSION))
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+            image.thumbnail((SCAN_MAX_DIMENSION, SCAN_MAX_DIMENSION), Image.Resampling.LANCZOS)
+            
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=SCAN_JPEG_QUALITY, optimize=True)
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(f"Unsupported image: {str(e)}")
+    
+    return base64.b64encode(output.getvalue()).decode('ascii')
+
+async def extract_voucher_details(image_base64: str) -> dict:
+    """Ask the vision model for voucher fields and parse its JSON answer"""
+    # Imported on first use; the client library is slow to load and only scans need it
+    from emergentintegrations.llm.chat import LlmChat, UserMessage, ImageContent
     
-    # Use aggregation for better performance
-    pipeline = [
+    # Initialize LLM chat
+    chat = LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=f"scan-{datetime.now().timestamp()}",
+        system_message="You are an expert at extracting voucher and coupon information from images. Extract all relevant details accurately."
+    ).with_model("openai", "gpt-4o-mini")
+    
+    # Create image content
+    image_content = ImageContent(image_base64=image_base64)
+    
+    # Create message with image
+    user_message = UserMessage(
+        text="""Analyze this receipt or coupon image and extract the following information in JSON format:
         {
-            "$facet": {
-                "total": [{"$count": "count"}],
-                "expired": [
-                    {"$match": {"expiry_date": {"$lt": current_date}}},
-                    {"$count": "count"}
-                ],
-                "expiring_soon": [
-                    {"$match": {
-                        "expiry_date": {
-                            "$gte": current_date,
-                            "$lte": threshold_date
-                        }
-                    }},
-                    {"$count": "count"}
-                ],
-                "active": [
-                    {"$match": {"expiry_date": {"$gt": threshold_date}}},
-                    {"$count": "count"}
-                ]
-            }
+            "brand_name": "store or brand name",
+            "discount_amount": "discount value (e.g., 20% OFF, $10 OFF)",
+            "voucher_code": "coupon/voucher code if visible",
+            "expiry_date": "expiry date in YYYY-MM-DD format if visible",
+            "category": "product category (e.g., Food, Fashion, Electronics)",
+            "description": "any additional terms or conditions"
         }
-    ]
+        
+        If any field is not visible or unclear in the image, set it to null.
+        Return ONLY the JSON object, no additional text.""",
+        file_contents=[image_content]
+    )
     
-    result = await db.vouchers.aggregate(pipeline).to_list(1)
+    # Get response from LLM; the breaker fails fast while the upstream is degraded
+    outcome = "error"
+    started = time.perf_counter()
+    try:
+        async with llm_breaker.guard():
+            response = await chat.send_message(user_message)
+        outcome = "success"
+    except CircuitOpen:
+        outcome = "rejected"
+        raise
+    finally:
+        llm_call_seconds.observe(time.perf_counter() - started, outcome)
     
-    if result:
-        stats = result[0]
-        return {
-            "total": stats["total"][0]["count"] if stats["total"] else 0,
-            "active": stats["active"][0]["count"] if stats["active"] else 0,
-            "expired": stats["expired"][0]["count"] if stats["expired"] else 0,
-            "expiring_soon": stats["expiring_soon"][0]["count"] if stats["expiring_soon"] else 0
-        }
+    # Clean the response - remove markdown code blocks if present
+    response_text = response.strip()
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.startswith("```"):
+        response_text = response_text[3:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+    response_text = response_text.strip()
     
-    return {"total": 0, "active": 0, "expired": 0, "expiring_soon": 0}
+    return json_lib.loads(response_text)
 
-@api_router.post("/vouchers/scan-image")
-async def scan_voucher_image(request: ImageScanRequest):
-    """Scan and extract voucher details from receipt or coupon image"""
+async def scan_image(image_bytes: bytes) -> dict:
+    """Preprocess an image in the worker pool, then extract its voucher fields"""
+    loop = asyncio.get_running_loop()
     try:
-        # Initialize LLM chat
-        chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=f"scan-{datetime.now().timestamp()}",
-            system_message="You are an expert at extracting voucher and coupon information from images. Extract all relevant details accurately."
-        ).with_model("openai", "gpt-4o-mini")
-        
-        # Create image content
-        image_content = ImageContent(image_base64=request.image_base64)
-        
-        # Create message with image
-        user_message = UserMessage(
-            text="""Analyze this receipt or coupon image and extract the following information in JSON format:
-            {
-                "brand_name": "store or brand name",
-                "discount_amount": "discount value (e.g., 20% OFF, $10 OFF)",
-                "voucher_code": "coupon/voucher code if visible",
-                "expiry_date": "expiry date in YYYY-MM-DD format if visible",
-                "category": "product category (e.g., Food, Fashion, Electronics)",
-                "description": "any additional terms or conditions"
-            }
-            
-            If any field is not visible or unclear in the image, set it to null.
-            Return ONLY the JSON object, no additional text.""",
-            file_contents=[image_content]
-        )
-        
-        # Get response from LLM
-        response = await chat.send_message(user_message)
+        prepared = await loop.run_in_executor(image_executor, preprocess_scan_image, image_bytes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await extract_voucher_details(prepared)
+
+async def decode_image_async(image_base64: str):
+    """Decode base64 image data in the worker pool, rejecting invalid input"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(image_executor, decode_image, image_base64)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="image_base64 is not valid base64")
+
+async def scan_image_cached(image_base64: str):
+    """Return (extracted_data, cached), coalescing identical concurrent scans"""
+    image_bytes, key = await decode_image_async(image_base64)
+    return await scan_bytes_cached(image_bytes, key)
+
+async def scan_bytes_cached(image_bytes: bytes, key: str):
+    """Cache and in-flight lookup for decoded image bytes hashed to key"""
+    cached = scan_cache.get(key)
+    if cached is not None:
+        return cached, True
+    
+    task = scan_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(scan_image(image_bytes))
+        scan_inflight[key] = task
         
-        # Parse the JSON response
-        import json
-        # Clean the response - remove markdown code blocks if present
-        response_text = response.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.startswith("```"):
-            response_text = response_text[3:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        response_text = response_text.strip()
+        def finish(done):
+            scan_inflight.pop(key, None)
+            if not done.cancelled() and done.exception() is None:
+                scan_cache[key] = done.result()
         
-        extracted_data = json.loads(response_text)
+        task.add_done_callback(finish)
+    
+    # Shield so one client disconnecting doesn't cancel the shared call
+    return await asyncio.shield(task), False
+
+@api_router.post("/vouchers/scan-image")
+async def scan_voucher_image(request: ImageScanRequest, http_request: Request):
+    """Scan and extract voucher details from receipt or coupon image"""
+    try:
+        scan_rate_limiter.acquire(client_key(http_request))
+        llm_breaker.check()
+        async with llm_admission.slot():
+            extracted_data, cached = await scan_image_cached(request.image_base64)
         
         return {
             "success": True,
-            "extracted_data": extracted_data
+            "extracted_data": extracted_data,
+            "cached": cached
         }
-        
+    
+    except HTTPException:
+        raise
+    except Rejected as e:
+        raise rejection_error(e)
     except Exception as e:
         logger.error(f"Error scanning image: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to scan image: {str(e)}")
 
-app.include_router(api_router)
+# Batch scanning: images are queued as jobs in MongoDB and drained by a
+# bounded pool of workers, so bulk imports don't hold HTTP connections open
+SCAN_BATCH_MAX = int(os.environ.get('SCAN_BATCH_MAX', '50'))
+# One base64 image per NDJSON line; bounds what a single line can buffer
+SCAN_MAX_LINE_BYTES = int(os.environ.get('SCAN_MAX_LINE_BYTES', str(16 * 1024 * 1024)))
+SCAN_JOB_WORKERS = int(os.environ.get('SCAN_JOB_WORKERS', '2'))
+SCAN_JOB_MAX_ATTEMPTS = int(os.environ.get('SCAN_JOB_MAX_ATTEMPTS', '3'))
+SCAN_JOB_BACKOFF_SECONDS = float(os.environ.get('SCAN_JOB_BACKOFF_SECONDS', '5'))
+SCAN_JOB_LEASE_SECONDS = 300
+SCAN_JOB_POLL_SECONDS = 5
+SCAN_JOB_RETENTION_DAYS = 7
+
+scan_job_wakeup = asyncio.Event()
+scan_job_workers = []
+
+def require_scan_jobs():
+    if not USES_MONGO:
+        raise HTTPException(status_code=503, detail="Batch scanning needs STORAGE_BACKEND=mongo")
+
+async def read_scan_batch(request: Request) -> List[bytes]:
+    """Image bytes from a multipart upload (field "files") or NDJSON lines; 413 past
+    SCAN_BATCH_MAX images or SCAN_MAX_LINE_BYTES per line"""
+    content_type = request.headers.get("content-type", "")
+    images = []
+    too_many = HTTPException(status_code=413, detail=f"At most {SCAN_BATCH_MAX} images per batch")
+    
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = form.getlist("files")
+        if len(uploads) > SCAN_BATCH_MAX:
+            raise too_many
+        for upload in uploads:
+            images.append(await upload.read())
+        return images
+    
+    # NDJSON: one {"image_base64": "..."} object per line, parsed as it arrives
+    buffer = b""
+    too_long = HTTPException(status_code=413, detail="Scan line too long")
+    
+    async def parse_line(line: bytes):
+        if len(line) > SCAN_MAX_LINE_BYTES:
+            raise too_long
+        if not line.strip():
+            return
+        try:
+            image_base64 = json_lib.loads(line)["image_base64"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Invalid NDJSON line {len(images) + 1}")
+        if len(images) >= SCAN_BATCH_MAX:
+            raise too_many
+        image_bytes, _ = await decode_image_async(image_base64)
+        images.append(image_bytes)
+    
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > SCAN_MAX_LINE_BYTES:
+            raise too_long
+        for line in lines:
+            await parse_line(line)
+    await parse_line(buffer)
+    
+    return images
+
+def scan_job_view(job: dict) -> dict:
+    return {key: value for key, value in job.items() if key not in ("_id", "image")}
+
+@api_router.post("/vouchers/scan-jobs")
+async def create_scan_jobs(request: Request, create_vouchers: bool = False):
+    """Queue a batch of images (multipart "files" or NDJSON) for background scanning"""
+    require_scan_jobs()
+    try:
+        scan_rate_limiter.acquire(client_key(request))
+    except Rejected as e:
+        raise rejection_error(e)
+    
+    images = await read_scan_batch(request)
+    if not images:
+        raise HTTPException(status_code=400, detail="No images provided")
+    
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    jobs = [{
+        "id": str(uuid.uuid4()),
+        "batch_id": batch_id,
+        "status": "queued",
+        "attempts": 0,
+        "create_voucher": create_vouchers,
+        "image": Binary(image_bytes),
+        "image_hash": hashlib.sha256(image_bytes).hexdigest(),
+        "created_at": now,
+        "next_attempt_at": now
+    } for image_bytes in images]
+    
+    await db.scan_jobs.insert_many(jobs)
+    scan_job_wakeup.set()
+    
+    return {
+        "batch_id": batch_id,
+        "jobs": [{"id": job["id"], "status": job["status"]} for job in jobs]
+    }
+
+@api_router.get("/vouchers/scan-jobs")
+async def get_scan_batch(batch_id: str):
+    """Get status and results for every job in a batch"""
+    require_scan_jobs()
+    jobs = await db.scan_jobs.find(
+        {"batch_id": batch_id},
+        {"_id": 0, "image": 0}
+    ).sort("created_at", 1).to_list(SCAN_BATCH_MAX)
+    
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+    
+    return {"batch_id": batch_id, "counts": counts, "jobs": jobs}
+
+@api_router.get("/vouchers/scan-jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    """Get status and result of a single scan job"""
+    require_scan_jobs()
+    job = await db.scan_jobs.find_one({"id": job_id}, {"_id": 0, "image": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
+async def claim_scan_job():
+    """Atomically lease the oldest runnable job (or one whose worker died)"""
+    now = datetime.now(timezone.utc)
+    return await db.scan_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "next_attempt_at": {"$lte": now}},
+            {"status": "running", "lease_until": {"$lt": now}}
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "started_at": now,
+                "lease_until": now + timedelta(seconds=SCAN_JOB_LEASE_SECONDS)
+            },
+            "$inc": {"attempts": 1}
+        },
+        sort=[("next_attempt_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def finish_scan_job(job: dict, update: dict):
+    now = datetime.now(timezone.utc)
+    await db.scan_jobs.update_one(
+        {"id": job["id"]},
+        {
+            "$set": {
+                **update,
+                "finished_at": now,
+                "expires_at": now + timedelta(days=SCAN_JOB_RETENTION_DAYS)
+            },
+            "$unset": {"image": "", "lease_until": ""}
+        }
+    )
+
+async def run_scan_job(job: dict):
+    """Scan one leased job, retrying transient failures with exponential backoff"""
+    try:
+        # Background jobs wait for a slot instead of being turned away
+        async with llm_admission.slot(wait=True):
+            extracted_data, _ = await scan_bytes_cached(bytes(job["image"]), job["image_hash"])
+    except HTTPException as e:
+        # Bad input; retrying won't help
+        await finish_scan_job(job, {"status": "failed", "error": e.detail})
+        return
+    except Rejected as e:
+        # Upstream is shedding load; come back later without spending an attempt
+        await db.scan_jobs.update_one(
+            {"id": job["id"]},
+            {
+                "$set": {
+                    "status": "queued",
+                    "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=e.retry_after)
+                },
+                "$inc": {"attempts": -1},
+                "$unset": {"lease_until": ""}
+            }
+        )
+        return
+    except Exception as e:
+        logger.warning(f"Scan job {job['id']} attempt {job['attempts']} failed: {str(e)}")
+        if job["attempts"] >= SCAN_JOB_MAX_ATTEMPTS:
+            await finish_scan_job(job, {"status": "failed", "error": str(e)})
+        else:
+            delay = SCAN_JOB_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+            await db.scan_jobs.update_one(
+                {"id": job["id"]},
+                {
+                    "$set": {
+                        "status": "queued",
+                        "error": str(e),
+                        "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=delay)
+                    },
+                    "$unset": {"lease_until": ""}
+                }
+            )
+        return
+    
+    update = {"status": "done", "result": extracted_data, "error": None}
+    if job.get("create_voucher"):
+        try:
+            fields = {key: value for key, value in extracted_data.items() if value is not None}
+            voucher = await create_voucher(VoucherCreate(**fields))
+            update["voucher_id"] = voucher.id
+        except ValidationError as e:
+            update["voucher_error"] = str(e)
+    
+    await finish_scan_job(job, update)
+
+async def scan_job_worker():
+    """Drain the scan job queue; woken on enqueue, polling for retries and other instances"""
+    while True:
+        scan_job_wakeup.clear()
+        try:
+            job = await claim_scan_job()
+        except Exception as e:
+            logger.error(f"Error claiming scan job: {str(e)}")
+            job = None
+        
+        if job is None:
+            try:
+                await asyncio.wait_for(scan_job_wakeup.wait(), SCAN_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        try:
+            await run_scan_job(job)
+        except Exception as e:
+            logger.error(f"Scan job {job['id']} crashed: {str(e)}")
 
 app.add_middleware(
     CORSMiddleware,
@@ -362,7 +1399,9 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
+app.add_middleware(MetricsMiddleware, registry=metrics_registry)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -373,41 +1412,111 @@ logger = logging.getLogger(__name__)
 @api_router.get("/reminder-settings", response_model=ReminderSettings)
 async def get_reminder_settings():
     """Get user's reminder settings"""
-    settings_doc = await db.reminder_settings.find_one({"id": "reminder_settings"}, {"_id": 0})
+    settings = await reminder_settings_cache.get()
     
-    if not settings_doc:
+    if not settings:
         # Return default settings
         default_settings = ReminderSettings()
         return default_settings
     
-    if isinstance(settings_doc.get('last_check'), str):
-        settings_doc['last_check'] = datetime.fromisoformat(settings_doc['last_check'])
-    
-    return ReminderSettings(**settings_doc)
+    return settings
 
 @api_router.post("/reminder-settings")
 async def update_reminder_settings(settings: ReminderSettingsUpdate):
     """Update user's reminder settings"""
     settings_dict = settings.model_dump()
     
-    await db.reminder_settings.update_one(
-        {"id": "reminder_settings"},
-        {"$set": settings_dict},
-        upsert=True
-    )
+    previous = await repository.update_settings("reminder_settings", settings_dict)
+    reminder_settings_cache.invalidate()
+    if previous is None or sorted(previous.get("reminder_days") or []) != sorted(settings.reminder_days):
+        await reschedule_reminders(settings.reminder_days)
     
     return {"message": "Reminder settings updated successfully"}
 
 @api_router.get("/pending-reminders")
 async def get_pending_reminders():
     """Get pending reminders for the user"""
-    reminders = await db.pending_reminders.find({}, {"_id": 0}).to_list(100)
+    # Fetched reminders are marked delivered; they stay (until expiry) so a re-run never requeues them
+    reminders = await repository.take_reminders(100, datetime.now(timezone.utc))
+    return {"reminders": reminders}
+
+# Reminders pushed over Server-Sent Events; clients ack each one by id
+REMINDER_STREAM_POLL_SECONDS = 5
+REMINDER_STREAM_HEARTBEAT_SECONDS = 15
+REMINDER_STREAM_PAGE_SIZE = 100
+
+# None until the first stream finds out whether the deployment supports change streams
+reminder_change_streams = None
+
+def reminder_event(reminder: dict) -> str:
+    reminder = {key: value for key, value in reminder.items() if key not in ("_id", "delivered_at")}
+    data = json_lib.dumps(reminder, separators=(",", ":"), default=json_default)
+    return f"id: {reminder['id']}\nevent: reminder\ndata: {data}\n\n"
+
+async def watch_reminder_events():
+    """Backlog then new reminders as they are queued; raises OperationFailure on standalone mongod"""
+    async for reminder in repository.watch_reminders(REMINDER_STREAM_HEARTBEAT_SECONDS):
+        yield ": keep-alive\n\n" if reminder is None else reminder_event(reminder)
+
+async def poll_reminder_events():
+    """Polling fallback: page through undelivered reminders in queue order"""
+    position = None
+    idle_seconds = 0
+    while True:
+        reminders, position = await repository.undelivered_reminders(position, REMINDER_STREAM_PAGE_SIZE)
+        for reminder in reminders:
+            yield reminder_event(reminder)
+        if reminders:
+            idle_seconds = 0
+            continue
+        
+        await asyncio.sleep(REMINDER_STREAM_POLL_SECONDS)
+        idle_seconds += REMINDER_STREAM_POLL_SECONDS
+        if idle_seconds >= REMINDER_STREAM_HEARTBEAT_SECONDS:
+            idle_seconds = 0
+            yield ": keep-alive\n\n"
+
+@api_router.get("/pending-reminders/stream")
+async def stream_pending_reminders():
+    """Server-Sent Events stream of undelivered reminders, then new ones as they are queued"""
+    async def events():
+        global reminder_change_streams
+        yield f"retry: {REMINDER_STREAM_POLL_SECONDS * 1000}\n\n"
+        
+        if reminder_change_streams is not False:
+            try:
+                async for event in watch_reminder_events():
+                    reminder_change_streams = True
+                    yield event
+                return
+            except OperationFailure as e:
+                if reminder_change_streams:
+                    raise
+                # Change streams need a replica set; remember and poll instead
+                logger.info(f"Change streams unavailable, polling for reminders: {str(e)}")
+                reminder_change_streams = False
+        
+        async for event in poll_reminder_events():
+            yield event
     
-    # Clear fetched reminders
-    if reminders:
-        await db.pending_reminders.delete_many({})
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/pending-reminders/{reminder_id}/ack")
+async def acknowledge_reminder(reminder_id: str):
+    """Mark one reminder delivered; only the first ack of a reminder succeeds"""
+    if not await repository.acknowledge_reminder(reminder_id, datetime.now(timezone.utc)):
+        raise HTTPException(status_code=404, detail="Reminder not found or already acknowledged")
     
-    return {"reminders": reminders}
+    return {"message": "Reminder acknowledged"}
+
+def load_flow_class():
+    """Import the OAuth flow class; run off the event loop as the first import is slow"""
+    from google_auth_oauthlib.flow import Flow
+    return Flow
 
 @api_router.get("/drive/connect")
 async def connect_drive():
@@ -418,6 +1527,7 @@ async def connect_drive():
         frontend_url = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")[0]
         redirect_uri = f"{frontend_url}/api/drive/callback"
         
+        Flow = await drive_engine.call(load_flow_class)
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -464,6 +1574,7 @@ async def drive_callback(code: str, state: str):
         frontend_url = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")[0]
         redirect_uri = f"{frontend_url}/api/drive/callback"
         
+        Flow = await drive_engine.call(load_flow_class)
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -478,28 +1589,27 @@ async def drive_callback(code: str, state: str):
             redirect_uri=redirect_uri
         )
         
-        flow.fetch_token(code=code)
+        # Token exchange is a blocking HTTP call
+        await drive_engine.call(flow.fetch_token, code=code)
         credentials = flow.credentials
         
         # Store credentials
-        await db.drive_credentials.update_one(
-            {"user_id": "default"},
-            {"$set": {
-                "user_id": "default",
-                "access_token": credentials.token,
-                "refresh_token": credentials.refresh_token,
-                "token_uri": credentials.token_uri,
-                "client_id": credentials.client_id,
-                "client_secret": credentials.client_secret,
-                "scopes": credentials.scopes,
-                "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }},
-            upsert=True
-        )
+        await repository.update_settings("drive_credentials", {
+            "user_id": "default",
+            "access_token": credentials.token,
+            "refresh_token": credentials.refresh_token,
+            "token_uri": credentials.token_uri,
+            "client_id": credentials.client_id,
+            "client_secret": credentials.client_secret,
+            "scopes": credentials.scopes,
+            "expiry": credentials.expiry.isoformat() if credentials.expiry else None,
+            "updated_at": datetime.now(timezone.utc).isoformat()
+        })
         
         # Clean up state
         await db.oauth_states.delete_one({"state": state})
+        drive_credentials_cache.invalidate()
+        drive_service_cache.invalidate()
         
         return RedirectResponse(url=f"{frontend_url}?drive_connected=true")
     
@@ -507,152 +1617,323 @@ async def drive_callback(code: str, state: str):
         logger.error(f"OAuth callback failed: {str(e)}")
         raise HTTPException(status_code=400, detail=f"OAuth failed: {str(e)}")
 
+async def save_refreshed_drive_token(creds) -> str:
+    """Persist a refreshed access token; returns the new updated_at stamp"""
+    updated_at = datetime.now(timezone.utc).isoformat()
+    # Not recreated if Drive was disconnected meanwhile
+    await repository.update_settings("drive_credentials", {
+        "access_token": creds.token,
+        "expiry": creds.expiry.isoformat() if creds.expiry else None,
+        "updated_at": updated_at
+    }, create=False)
+    drive_credentials_cache.invalidate()
+    return updated_at
+
 async def get_drive_service():
-    """Get Google Drive service with auto-refresh credentials"""
-    creds_doc = await db.drive_credentials.find_one({"user_id": "default"})
+    """Get the cached Google Drive service, refreshing credentials when they expire"""
+    creds_doc = await drive_credentials_cache.get()
     if not creds_doc:
+        drive_service_cache.invalidate()
         return None
     
-    creds = Credentials(
-        token=creds_doc["access_token"],
-        refresh_token=creds_doc.get("refresh_token"),
-        token_uri=creds_doc["token_uri"],
-        client_id=creds_doc["client_id"],
-        client_secret=creds_doc["client_secret"],
-        scopes=creds_doc["scopes"]
-    )
+    return await drive_service_cache.get(creds_doc, save_refreshed_drive_token)
+
+# Drive backups are gzip NDJSON: a full snapshot plus delta segments holding
+# the changes since the previous sync, folded back into a snapshot periodically
+DRIVE_SNAPSHOT_NAME = 'vouchervault_snapshot.ndjson.gz'
+DRIVE_COMPACT_AFTER_SEGMENTS = int(os.environ.get('DRIVE_COMPACT_AFTER_SEGMENTS', '24'))
+BACKUP_BATCH_SIZE = 500
+
+# Derived search/geo/reminder fields are rebuilt on restore, so they are not backed up
+VOUCHER_BACKUP_EXCLUDE = (
+    "brand_key", "location_terms", "region_terms", "search_version", "geo", "next_reminder_at"
+)
+
+async def write_backup_records(writer: BackupWriter, docs, to_record):
+    """Stream documents into the backup file in batches on the Drive thread"""
+    batch = []
+    async for doc in docs:
+        batch.append(to_record(doc))
+        if len(batch) >= BACKUP_BATCH_SIZE:
+            await drive_engine.call(writer.write, batch)
+            batch = []
+    if batch:
+        await drive_engine.call(writer.write, batch)
+
+async def iter_delta_records(after_seq: int, upto_seq: int):
+    """Upsert and delete records in the window, merged into change_seq order.
+
+    An imported voucher can reuse a deleted id, so a restore has to replay
+    the delete before the upsert that follows it.
+    """
+    upserts = repository.iter_changed_vouchers(after_seq, upto_seq, VOUCHER_BACKUP_EXCLUDE)
+    deletes = repository.iter_tombstones(after_seq, upto_seq)
     
-    # Auto-refresh if expired
-    if creds.expired and creds.refresh_token:
-        creds.refresh(GoogleRequest())
-        await db.drive_credentials.update_one(
-            {"user_id": "default"},
-            {"$set": {
-                "access_token": creds.token,
-                "expiry": creds.expiry.isoformat() if creds.expiry else None,
-                "updated_at": datetime.now(timezone.utc).isoformat()
-            }}
-        )
+    async def next_or_none(docs):
+        try:
+            return await docs.__anext__()
+        except StopAsyncIteration:
+            return None
     
-    return build('drive', 'v3', credentials=creds)
+    voucher = await next_or_none(upserts)
+    tombstone = await next_or_none(deletes)
+    while voucher is not None or tombstone is not None:
+        if tombstone is None or (voucher is not None and voucher["change_seq"] < tombstone["change_seq"]):
+            yield {"op": "upsert", "seq": voucher["change_seq"], "voucher": voucher}
+            voucher = await next_or_none(upserts)
+        else:
+            yield {"op": "delete", "seq": tombstone["change_seq"], "id": tombstone["id"]}
+            tombstone = await next_or_none(deletes)
 
-@api_router.post("/drive/sync")
-async def sync_to_drive():
-    """Sync vouchers to Google Drive"""
+async def run_drive_sync(full: bool = False) -> dict:
+    """Back up vouchers to Drive, recording progress in sync_status"""
+    started_at = datetime.now(timezone.utc)
+    # Read directly: delta bookkeeping must see syncs made by other workers
+    status = await repository.get_settings("drive_sync") or {}
+    await repository.update_settings("drive_sync", {
+        "service": "google_drive",
+        "status": "running",
+        "started_at": started_at.isoformat(),
+        "error": None
+    })
+    sync_status_cache.invalidate()
+    
+    previous_seq = status.get("high_water")
+    snapshot = (
+        full
+        or previous_seq is None
+        or status.get("delta_segments", 0) >= DRIVE_COMPACT_AFTER_SEGMENTS
+    )
+    # Changes made while the sync runs fall above this mark and go in the next delta
+    high_water = await current_change_seq()
+    writer = BackupWriter()
+    
     try:
         service = await get_drive_service()
         if not service:
-            raise HTTPException(status_code=400, detail="Google Drive not connected")
-        
-        # Get all vouchers
-        vouchers = await db.vouchers.find({}, {"_id": 0}).to_list(1000)
+            raise RuntimeError("Google Drive not connected")
         
-        # Convert to JSON
-        data = {
-            "vouchers": vouchers,
-            "synced_at": datetime.now(timezone.utc).isoformat()
+        header = {
+            "format": "vouchervault-backup",
+            "version": 1,
+            "kind": "snapshot" if snapshot else "delta",
+            "from_seq": 0 if snapshot else previous_seq,
+            "to_seq": high_water,
+            "created_at": started_at.isoformat()
         }
+        await drive_engine.call(writer.write, [header])
         
-        json_str = json_lib.dumps(data, indent=2, default=str)
-        file_metadata = {
-            'name': 'vouchervault_backup.json',
-            'mimeType': 'application/json'
-        }
+        if snapshot:
+            await write_backup_records(
+                writer,
+                repository.iter_vouchers(VOUCHER_BACKUP_EXCLUDE),
+                lambda voucher: {"op": "upsert", "seq": voucher.get("change_seq", 0), "voucher": voucher}
+            )
+        elif high_water > previous_seq:
+            await write_backup_records(writer, iter_delta_records(previous_seq, high_water), lambda record: record)
         
-        media = MediaIoBaseUpload(
-            io.BytesIO(json_str.encode('utf-8')),
-            mimetype='application/json',
-            resumable=True
-        )
+        changes = writer.lines - 1
+        update = {"high_water": high_water}
+        stream = await drive_engine.call(writer.finish)
         
-        # Check if file exists
-        results = service.files().list(
-            q="name='vouchervault_backup.json' and trashed=false",
-            spaces='drive',
-            fields='files(id, name)'
-        ).execute()
-        
-        files = results.get('files', [])
-        
-        if files:
-            # Update existing file
-            file_id = files[0]['id']
-            service.files().update(
-                fileId=file_id,
-                media_body=media
-            ).execute()
-        else:
-            # Create new file
-            service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id'
-            ).execute()
-        
-        # Update sync status
-        await db.sync_status.update_one(
-            {"service": "google_drive"},
-            {"$set": {
-                "service": "google_drive",
-                "last_sync": datetime.now(timezone.utc).isoformat(),
-                "status": "success",
-                "voucher_count": len(vouchers)
-            }},
-            upsert=True
+        if snapshot:
+            await drive_engine.call(upload_file, service, DRIVE_SNAPSHOT_NAME, stream, 'application/gzip')
+            # The snapshot supersedes every delta segment uploaded before it
+            for file_id in status.get("delta_files", []):
+                await drive_engine.call(delete_file, service, file_id)
+            update.update({"delta_segments": 0, "delta_files": [], "snapshot_at": started_at.isoformat()})
+        elif changes:
+            name = f"vouchervault_delta_{previous_seq + 1:012d}_{high_water:012d}.ndjson.gz"
+            file_id = await drive_engine.call(create_file, service, name, stream, 'application/gzip')
+            update.update({
+                "delta_segments": status.get("delta_segments", 0) + 1,
+                "delta_files": status.get("delta_files", []) + [file_id]
+            })
+    except Exception as e:
+        logger.error(f"Drive sync failed: {str(e)}")
+        drive_sync_seconds.observe(
+            (datetime.now(timezone.utc) - started_at).total_seconds(),
+            "snapshot" if snapshot else "delta", "failure"
         )
-        
+        await repository.update_settings("drive_sync", {"status": "failed", "error": str(e)})
+        sync_status_cache.invalidate()
+        raise
+    finally:
+        await drive_engine.call(writer.close)
+    
+    synced_at = datetime.now(timezone.utc).isoformat()
+    voucher_count = await repository.count_vouchers()
+    mode = "snapshot" if snapshot else "delta"
+    drive_sync_seconds.observe((datetime.now(timezone.utc) - started_at).total_seconds(), mode, "success")
+    
+    # Update sync status
+    await repository.update_settings("drive_sync", {
+        **update,
+        "service": "google_drive",
+        "last_sync": synced_at,
+        "last_mode": mode,
+        "last_changes": changes,
+        "status": "success",
+        "voucher_count": voucher_count,
+        "duration_seconds": (datetime.now(timezone.utc) - started_at).total_seconds()
+    })
+    sync_status_cache.invalidate()
+    
+    return {"voucher_count": voucher_count, "changes": changes, "mode": mode, "synced_at": synced_at}
+
+@api_router.post("/drive/sync")
+async def sync_to_drive(background: bool = False, full: bool = False):
+    """Sync vouchers to Google Drive; with background=true, return immediately"""
+    creds_doc = await drive_credentials_cache.get()
+    if not creds_doc:
+        raise HTTPException(status_code=400, detail="Google Drive not connected")
+    
+    task = drive_engine.start(lambda: run_drive_sync(full=full))
+    if background:
         return {
             "success": True,
-            "message": f"Synced {len(vouchers)} vouchers to Google Drive",
-            "synced_at": datetime.now(timezone.utc).isoformat()
+            "status": "running",
+            "message": "Google Drive sync started"
         }
     
+    try:
+        result = await asyncio.shield(task)
     except Exception as e:
-        logger.error(f"Drive sync failed: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Sync failed: {str(e)}")
+    
+    if result['mode'] == "snapshot":
+        message = f"Synced {result['voucher_count']} vouchers to Google Drive"
+    else:
+        message = f"Synced {result['changes']} changes to Google Drive"
+    
+    return {
+        "success": True,
+        "message": message,
+        "mode": result['mode'],
+        "synced_at": result['synced_at']
+    }
 
 @api_router.get("/drive/status")
 async def get_drive_status():
     """Get Google Drive connection and sync status"""
-    creds_doc = await db.drive_credentials.find_one({"user_id": "default"})
-    sync_doc = await db.sync_status.find_one({"service": "google_drive"})
+    creds_doc = await drive_credentials_cache.get()
+    sync_doc = await sync_status_cache.get()
     
     return {
         "connected": creds_doc is not None,
         "last_sync": sync_doc.get("last_sync") if sync_doc else None,
-        "voucher_count": sync_doc.get("voucher_count") if sync_doc else 0
+        "voucher_count": sync_doc.get("voucher_count") if sync_doc else 0,
+        "sync_status": "running" if drive_engine.running else (sync_doc.get("status") if sync_doc else None),
+        "last_sync_mode": sync_doc.get("last_mode") if sync_doc else None,
+        "sync_error": sync_doc.get("error") if sync_doc else None
     }
 
 @api_router.post("/drive/disconnect")
 async def disconnect_drive():
     """Disconnect Google Drive"""
-    await db.drive_credentials.delete_one({"user_id": "default"})
-    await db.sync_status.delete_one({"service": "google_drive"})
+    await repository.delete_settings("drive_credentials")
+    await repository.delete_settings("drive_sync")
+    drive_credentials_cache.invalidate()
+    sync_status_cache.invalidate()
+    drive_service_cache.invalidate()
     return {"success": True, "message": "Google Drive disconnected"}
 
-@app.on_event("startup")
-async def startup_event():
-    # Create database indexes for better performance
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus metrics for this worker process"""
+    scan_in_flight.set(llm_admission.in_flight)
+    llm_circuit_state.set({"closed": 0, "half_open": 1, "open": 2}[llm_breaker.state])
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+app.include_router(api_router)
+
+# Indexes the queries above rely on, besides the repository's own; built in
+# the background by ensure_indexes
+DECLARED_INDEXES = {
+    "scan_jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("batch_id", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)]),
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+    ],
+    "oauth_states": [
+        IndexModel([("state", ASCENDING)])
+    ]
+}
+
+async def prepare_indexes():
+    """Create missing indexes concurrently so startup doesn't wait on index builds"""
     try:
-        await db.vouchers.create_index("expiry_date")
-        await db.vouchers.create_index("store_type")
-        await db.vouchers.create_index("region")
-        await db.vouchers.create_index("brand_name")
-        logger.info("Database indexes created successfully")
+        totals = await ensure_indexes(db, {**DECLARED_INDEXES, **repository.mongo_indexes})
+        logger.info(
+            f"Indexes ready: {totals['created']} created, {totals['existing']} existing, {totals['failed']} failed"
+        )
     except Exception as e:
-        logger.warning(f"Index creation warning (may already exist): {str(e)}")
+        logger.error(f"Error ensuring indexes: {str(e)}")
+
+async def start_scheduler():
+    """Import APScheduler off the event loop, then schedule the periodic jobs"""
+    global scheduler
+    try:
+        schedulers = await asyncio.to_thread(importlib.import_module, "apscheduler.schedulers.asyncio")
+        triggers = await asyncio.to_thread(importlib.import_module, "apscheduler.triggers.interval")
+    except Exception as e:
+        logger.error(f"Failed to load scheduler: {str(e)}")
+        return
     
-    # Start the scheduler
+    scheduler = schedulers.AsyncIOScheduler()
     scheduler.add_job(
-        check_and_send_reminders,
-        IntervalTrigger(hours=6),  # Check every 6 hours
+        scheduler_lease.only_leader(check_and_send_reminders) if repository.shared else check_and_send_reminders,
+        triggers.IntervalTrigger(minutes=REMINDER_CHECK_MINUTES),  # Only reads vouchers that are due
         id='reminder_checker',
         replace_existing=True
     )
     scheduler.start()
     logger.info("Reminder scheduler started")
 
+@app.on_event("startup")
+async def startup_event():
+    global singleton_watcher, scheduler_lease_task
+    
+    # Index builds, search index and reminder schedule load without delaying startup
+    if USES_MONGO:
+        asyncio.create_task(prepare_indexes())
+    asyncio.create_task(prepare_search_index())
+    asyncio.create_task(prepare_reminder_schedule())
+    
+    # Pick up singleton changes made by other workers (replica sets only)
+    watched = {
+        repository.settings_collections[cache.name]: cache
+        for cache in (reminder_settings_cache, drive_credentials_cache, sync_status_cache)
+        if cache.name in repository.settings_collections
+    }
+    singleton_watcher = asyncio.create_task(watch_collections(db, watched))
+    
+    # Start the scan job workers
+    if USES_MONGO:
+        for _ in range(SCAN_JOB_WORKERS):
+            scan_job_workers.append(asyncio.create_task(scan_job_worker()))
+    
+    # Start the scheduler; its library loads in the background
+    if repository.shared:
+        scheduler_lease_task = asyncio.create_task(scheduler_lease.run())
+    asyncio.create_task(start_scheduler())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    scheduler.shutdown()
+    if scheduler is not None:
+        scheduler.shutdown()
+    if scheduler_lease_task is not None:
+        scheduler_lease_task.cancel()
+    try:
+        await scheduler_lease.release()
+    except Exception as e:
+        logger.error(f"Error releasing scheduler lease: {str(e)}")
+    if singleton_watcher is not None:
+        singleton_watcher.cancel()
+    for worker in scan_job_workers:
+        worker.cancel()
+    image_executor.shutdown(wait=False)
+    drive_engine.shutdown()
+    await repository.close()
     client.close()
\ No newline at end of file
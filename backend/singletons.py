@@ -0,0 +1,83 @@
+"""Read-through, in-process cache for settings-style singleton documents.
+
+Documents like the reminder settings or Drive credentials are read on nearly
+every request and written rarely. Each `SingletonCache` keeps the document
+returned by `load()` (parsed, if a parser is given) for `ttl_seconds`. Writers
+in this process call `invalidate()`; writes from other workers are picked up
+by `watch_collections()` on replica sets, which follows every cached collection
+over one database-level change stream, or after the TTL otherwise.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+from pymongo.errors import OperationFailure
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+
+class SingletonCache(Generic[T]):
+    """One document named `name`, fetched by `load`"""
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], Awaitable[Optional[dict]]],
+        ttl_seconds: float,
+        parse: Optional[Callable[[dict], T]] = None
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self._load = load
+        self._parse = parse
+        self._lock = asyncio.Lock()
+        self._version = 0
+        self.invalidate()
+
+    def invalidate(self):
+        self._version += 1
+        self._value: Optional[T] = None
+        self._expires_at = 0.0
+
+    async def get(self) -> Optional[T]:
+        """The cached document, or None if it doesn't exist; treat the result as read-only"""
+        if time.monotonic() < self._expires_at:
+            return self._value
+
+        async with self._lock:
+            if time.monotonic() < self._expires_at:
+                return self._value
+
+            version = self._version
+            doc = await self._load()
+            value = self._parse(doc) if doc is not None and self._parse else doc
+            # An invalidate() during the read means the result may predate that write
+            if version == self._version:
+                self._value = value
+                self._expires_at = time.monotonic() + self.ttl_seconds
+            return value
+
+
+async def watch_collections(db, caches: Dict[str, SingletonCache]):
+    """Invalidate caches as their collections change, until cancelled.
+
+    Motor runs a change stream on one of its executor threads, so a single
+    database-level stream filtered to the cached collections serves them all.
+    """
+    if not caches:
+        return
+    pipeline = [{"$match": {"ns.coll": {"$in": list(caches)}}}]
+    try:
+        async with db.watch(pipeline) as stream:
+            async for change in stream:
+                cache = caches.get(change.get("ns", {}).get("coll"))
+                if cache is not None:
+                    cache.invalidate()
+    except OperationFailure as e:
+        # Standalone mongod: cross-worker changes show up once the TTL lapses
+        logger.info(f"Not watching {', '.join(caches)} for changes: {str(e)}")
+    except Exception as e:
+        logger.error(f"Stopped watching {', '.join(caches)} for changes: {str(e)}")
@@ -0,0 +1,1235 @@
+"""Storage backends for vouchers, pending reminders and settings.
+
+Handlers read and write these through a `VoucherRepository`.
+`MongoVoucherRepository` stores them in the MongoDB collections the app has
+always used. `MemoryVoucherRepository` keeps them in process, with hash indexes
+on id, brand and region and sorted indexes on expiry, creation time and
+reminder due time, so reads never leave the process. Given a path, it also
+appends every change to a JSON-lines log that is replayed (and compacted) on
+startup. Its state is private to one process, so it suits single-worker
+deployments and running the API without a database.
+
+Settings are singleton documents by key: the reminder settings, the Drive
+credentials and the Drive sync status.
+
+Repositories hand out stored documents; callers treat them as read-only.
+Voucher reads take `fields`, the fields the caller needs; a backend may return
+more.
+"""
+import asyncio
+import bisect
+import json
+import logging
+import math
+import os
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from search import backfill_search_fields
+
+# Same Earth radius MongoDB uses for spherical $geoNear distances
+EARTH_RADIUS_M = 6378100.0
+DUPLICATE_ID = "Voucher id already exists"
+# What callers need from a deleted voucher to adjust cached stats
+DELETED_FIELDS = ("id", "expiry_date", "category", "currency")
+
+logger = logging.getLogger(__name__)
+
+
+class VoucherRepository(ABC):
+    """Voucher, pending reminder and settings storage used by the API"""
+
+    # False when the data lives in this process only, so other workers can't see it
+    shared = True
+    # MongoDB collection holding each settings document, by key; watched for writes by other workers
+    settings_collections: Dict[str, str] = {}
+
+    @property
+    def mongo_indexes(self) -> Dict[str, List[IndexModel]]:
+        """MongoDB indexes this backend needs, by collection"""
+        return {}
+
+    async def migrate(self):
+        """Bring documents written by older versions up to date"""
+
+    async def close(self):
+        """Release files or connections held by the backend"""
+
+    # Vouchers
+
+    @abstractmethod
+    async def insert_vouchers(self, docs: List[dict]) -> Dict[int, str]:
+        """Insert voucher documents; returns error messages by position for those that failed"""
+
+    @abstractmethod
+    async def delete_voucher(self, voucher_id: str) -> Optional[dict]:
+        """Delete one voucher; returns at least its DELETED_FIELDS, or None if it doesn't exist"""
+
+    @abstractmethod
+    async def delete_vouchers(self, ids: List[str]) -> Tuple[List[dict], bool]:
+        """Delete vouchers by id; returns the ones found (at least their DELETED_FIELDS) and
+        whether all of them were deleted here"""
+
+    @abstractmethod
+    async def list_vouchers(
+        self,
+        limit: int,
+        category: Optional[str] = None,
+        store_type: Optional[str] = None,
+        region: Optional[str] = None,
+        expiring_before: Optional[datetime] = None,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """Vouchers newest first by (created_at, id), strictly after `after`"""
+
+    @abstractmethod
+    async def expiring_vouchers(
+        self,
+        start: datetime,
+        end: datetime,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """Vouchers with start <= expiry_date <= end, soonest first by (expiry_date, id)"""
+
+    @abstractmethod
+    async def vouchers_near(
+        self,
+        latitude: float,
+        longitude: float,
+        max_distance_m: float,
+        store_types: Sequence[str],
+        limit: int,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """Located vouchers of the given store types within the distance, closest first"""
+
+    @abstractmethod
+    async def match_vouchers(
+        self,
+        region_patterns: Sequence,
+        brand_keys: Sequence[str],
+        location_patterns: Sequence,
+        exclude_ids: Sequence[str],
+        limit: int,
+        fields: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """Regional vouchers whose region_terms match every region pattern, and specific
+        vouchers whose brand_key is listed or whose location_terms match every location
+        pattern; an empty pattern or key list matches nothing"""
+
+    @abstractmethod
+    async def vouchers_by_store_type(
+        self, store_type: str, limit: int, fields: Optional[Sequence[str]] = None
+    ) -> List[dict]:
+        """Any `limit` vouchers of one store type"""
+
+    @abstractmethod
+    async def brand_keys(self) -> List[str]:
+        """Distinct normalized brand keys"""
+
+    @abstractmethod
+    async def voucher_stats(self, now: datetime, threshold: datetime) -> dict:
+        """Counts by expiry bucket, category and currency, plus the first expiry
+        dates at or after `now` and after `threshold`"""
+
+    @abstractmethod
+    async def count_vouchers(self) -> int:
+        """Number of vouchers (may be an estimate)"""
+
+    @abstractmethod
+    def iter_vouchers(self, exclude: Sequence[str] = ()) -> AsyncIterator[dict]:
+        """Every voucher, without the excluded fields"""
+
+    @abstractmethod
+    def iter_changed_vouchers(self, after_seq: int, upto_seq: int, exclude: Sequence[str] = ()) -> AsyncIterator[dict]:
+        """Vouchers with after_seq < change_seq <= upto_seq, in change_seq order"""
+
+    @abstractmethod
+    async def add_tombstones(self, tombstones: List[dict]):
+        """Record deleted voucher ids with their change_seq and deleted_at"""
+
+    @abstractmethod
+    def iter_tombstones(self, after_seq: int, upto_seq: int) -> AsyncIterator[dict]:
+        """Tombstones with after_seq < change_seq <= upto_seq, in change_seq order"""
+
+    # Reminder schedule
+
+    @abstractmethod
+    async def unexpired_vouchers(self, now: datetime, after_id: Optional[str], limit: int) -> List[dict]:
+        """Ids and expiry dates of vouchers expiring after now, in id order after `after_id`"""
+
+    @abstractmethod
+    async def due_vouchers(self, now: datetime, limit: int) -> List[dict]:
+        """Ids, brand names and expiry dates of vouchers whose next reminder is due"""
+
+    @abstractmethod
+    async def set_reminder_schedule(self, schedule: Dict[str, Optional[datetime]]):
+        """Set next_reminder_at by voucher id; None clears it"""
+
+    # Pending reminders
+
+    @abstractmethod
+    async def queue_reminders(self, reminders: List[dict]) -> int:
+        """Insert reminders not yet queued for their (voucher_id, days_left); returns how many were new"""
+
+    @abstractmethod
+    async def take_reminders(self, limit: int, now: datetime) -> List[dict]:
+        """Oldest undelivered reminders, marked delivered at `now`"""
+
+    @abstractmethod
+    async def undelivered_reminders(self, after: Any, limit: int) -> Tuple[List[dict], Any]:
+        """A page of undelivered reminders in queue order and the position to resume after"""
+
+    @abstractmethod
+    def watch_reminders(self, heartbeat_seconds: float) -> AsyncIterator[Optional[dict]]:
+        """Undelivered reminders, then new ones as they are queued; None after
+        `heartbeat_seconds` without one"""
+
+    @abstractmethod
+    async def acknowledge_reminder(self, reminder_id: str, now: datetime) -> bool:
+        """Mark a reminder delivered; False if it doesn't exist or already was"""
+
+    # Settings, sequences and migrations
+
+    @abstractmethod
+    async def get_settings(self, key: str) -> Optional[dict]:
+        """The settings document stored under `key`"""
+
+    @abstractmethod
+    async def update_settings(self, key: str, fields: dict, create: bool = True) -> Optional[dict]:
+        """Set fields on a settings document, creating it if needed (and `create`); returns the previous one"""
+
+    @abstractmethod
+    async def delete_settings(self, key: str):
+        """Remove a settings document"""
+
+    @abstractmethod
+    async def next_sequence(self, name: str, count: int = 1) -> int:
+        """Reserve count numbers from a named sequence; returns the highest one"""
+
+    @abstractmethod
+    async def current_sequence(self, name: str) -> int:
+        """Highest number reserved from a named sequence so far"""
+
+    @abstractmethod
+    async def migration_done(self, name: str, version: int) -> bool:
+        """Whether a data migration has completed at this version"""
+
+    @abstractmethod
+    async def record_migration(self, name: str, version: int):
+        """Mark a data migration as completed at this version"""
+
+
+def _projection(fields: Optional[Sequence[str]]) -> dict:
+    return {"_id": 0, **{name: 1 for name in fields}} if fields else {"_id": 0}
+
+
+class MongoVoucherRepository(VoucherRepository):
+    """Vouchers, tombstones, pending reminders, settings, counters and migrations in MongoDB"""
+
+    # Settings documents kept where earlier versions stored them: (collection, filter) by key;
+    # any other key is a document in reminder_settings with that id
+    SETTINGS_DOCUMENTS = {
+        "reminder_settings": ("reminder_settings", {"id": "reminder_settings"}),
+        "drive_credentials": ("drive_credentials", {"user_id": "default"}),
+        "drive_sync": ("sync_status", {"service": "google_drive"})
+    }
+    settings_collections = {key: collection for key, (collection, _) in SETTINGS_DOCUMENTS.items()}
+
+    def __init__(self, db, reminder_retention: timedelta, tombstone_retention: timedelta, batch_size: int = 500):
+        self.db = db
+        self.reminder_retention = reminder_retention
+        self.tombstone_retention = tombstone_retention
+        self.batch_size = batch_size
+        # One change stream of queued reminders per process, fanned out to a queue per watcher
+        self._reminder_watchers = set()
+        self._reminder_feed: Optional[asyncio.Future] = None
+        self._reminder_feed_task: Optional[asyncio.Task] = None
+
+    @property
+    def mongo_indexes(self):
+        return {
+            "vouchers": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                # Newest-first listing, optionally filtered, paged on (created_at, id)
+                IndexModel([("created_at", DESCENDING), ("id", DESCENDING)]),
+                IndexModel([("category", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+                IndexModel([("store_type", ASCENDING), ("region", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+                IndexModel([("region", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+                IndexModel([("expiry_date", ASCENDING), ("id", ASCENDING)]),
+                IndexModel([("brand_key", ASCENDING)]),
+                IndexModel([("store_type", ASCENDING), ("region_terms", ASCENDING)]),
+                IndexModel([("store_type", ASCENDING), ("location_terms", ASCENDING)]),
+                IndexModel([("geo", GEOSPHERE)]),
+                IndexModel([("change_seq", ASCENDING)]),
+                IndexModel([("next_reminder_at", ASCENDING)], sparse=True)
+            ],
+            "voucher_tombstones": [
+                IndexModel([("change_seq", ASCENDING)]),
+                IndexModel([("deleted_at", ASCENDING)], expireAfterSeconds=int(self.tombstone_retention.total_seconds()))
+            ],
+            "counters": [
+                IndexModel([("id", ASCENDING)], unique=True)
+            ],
+            "pending_reminders": [
+                IndexModel([("voucher_id", ASCENDING), ("days_left", ASCENDING)], unique=True),
+                IndexModel([("id", ASCENDING)], unique=True, sparse=True),
+                IndexModel([("delivered_at", ASCENDING)], sparse=True),
+                IndexModel([("created_at", ASCENDING)], expireAfterSeconds=int(self.reminder_retention.total_seconds()))
+            ]
+        }
+
+    async def migrate(self):
+        await backfill_search_fields(self.db, self.batch_size)
+
+    async def close(self):
+        if self._reminder_feed_task is not None:
+            self._reminder_feed_task.cancel()
+
+    async def insert_vouchers(self, docs):
+        failures = {}
+        try:
+            await self.db.vouchers.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                code = write_error.get("code")
+                failures[write_error["index"]] = DUPLICATE_ID if code == 11000 else write_error.get("errmsg")
+        return failures
+
+    async def delete_voucher(self, voucher_id):
+        return await self.db.vouchers.find_one_and_delete({"id": voucher_id}, _projection(DELETED_FIELDS))
+
+    async def delete_vouchers(self, ids):
+        found = await self.db.vouchers.find({"id": {"$in": ids}}, _projection(DELETED_FIELDS)).to_list(len(ids))
+        if not found:
+            return [], True
+        result = await self.db.vouchers.delete_many({"id": {"$in": [voucher["id"] for voucher in found]}})
+        return found, result.deleted_count == len(found)
+
+    async def list_vouchers(self, limit, category=None, store_type=None, region=None,
+                            expiring_before=None, after=None, fields=None):
+        filters = []
+        if category is not None:
+            filters.append({"category": category})
+        if store_type is not None:
+            filters.append({"store_type": store_type})
+        if region is not None:
+            filters.append({"region": region})
+        if expiring_before is not None:
+            filters.append({"expiry_date": {"$lte": expiring_before}})
+        if after is not None:
+            created_at, last_id = after
+            filters.append({"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": last_id}}
+            ]})
+        query = {"$and": filters} if filters else {}
+        return await self.db.vouchers.find(query, _projection(fields)).sort(
+            [("created_at", -1), ("id", -1)]
+        ).limit(limit).to_list(limit)
+
+    async def expiring_vouchers(self, start, end, limit, after=None, fields=None):
+        query = {"expiry_date": {"$gte": start, "$lte": end}}
+        if after is not None:
+            last_expiry, last_id = after
+            query = {"$and": [query, {"$or": [
+                {"expiry_date": {"$gt": last_expiry}},
+                {"expiry_date": last_expiry, "id": {"$gt": last_id}}
+            ]}]}
+        return await self.db.vouchers.find(query, _projection(fields)).sort(
+            [("expiry_date", 1), ("id", 1)]
+        ).limit(limit).to_list(limit)
+
+    async def vouchers_near(self, latitude, longitude, max_distance_m, store_types, limit, fields=None):
+        return await self.db.vouchers.aggregate([
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [longitude, latitude]},
+                "key": "geo",
+                "distanceField": "distance_m",
+                "maxDistance": max_distance_m,
+                "spherical": True,
+                "query": {"store_type": {"$in": list(store_types)}}
+            }},
+            {"$limit": limit},
+            {"$project": _projection(fields)}
+        ]).to_list(limit)
+
+    async def match_vouchers(self, region_patterns, brand_keys, location_patterns, exclude_ids, limit, fields=None):
+        # Anchored prefix matches on normalized token arrays stay on the indexes
+        queries = []
+        if region_patterns:
+            queries.append({
+                "store_type": "regional",
+                "$and": [{"region_terms": pattern} for pattern in region_patterns]
+            })
+        store_matches = []
+        if brand_keys:
+            store_matches.append({"brand_key": {"$in": list(brand_keys)}})
+        if location_patterns:
+            store_matches.append({"$and": [{"location_terms": pattern} for pattern in location_patterns]})
+        if store_matches:
+            queries.append({"store_type": "specific", "$or": store_matches})
+        if not queries:
+            return []
+        return await self.db.vouchers.find(
+            {"$or": queries, "id": {"$nin": list(exclude_ids)}}, _projection(fields)
+        ).limit(limit).to_list(limit)
+
+    async def vouchers_by_store_type(self, store_type, limit, fields=None):
+        return await self.db.vouchers.find({"store_type": store_type}, _projection(fields)).limit(limit).to_list(limit)
+
+    async def brand_keys(self):
+        return await self.db.vouchers.distinct("brand_key")
+
+    async def voucher_stats(self, now, threshold):
+        def first_expiry_after(match):
+            return [
+                {"$match": {"expiry_date": match}},
+                {"$sort": {"expiry_date": 1}},
+                {"$limit": 1},
+                {"$project": {"_id": 0, "expiry_date": 1}}
+            ]
+
+        pipeline = [
+            {
+                "$facet": {
+                    "buckets": [
+                        {"$group": {
+                            "_id": None,
+                            "total": {"$sum": 1},
+                            "expired": {"$sum": {"$cond": [{"$lt": ["$expiry_date", now]}, 1, 0]}},
+                            "active": {"$sum": {"$cond": [{"$gt": ["$expiry_date", threshold]}, 1, 0]}}
+                        }}
+                    ],
+                    "by_category": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}],
+                    "by_currency": [{"$group": {"_id": "$currency", "count": {"$sum": 1}}}],
+                    "next_expired": first_expiry_after({"$gte": now}),
+                    "next_expiring_soon": first_expiry_after({"$gt": threshold})
+                }
+            }
+        ]
+
+        result = (await self.db.vouchers.aggregate(pipeline).to_list(1))[0]
+        buckets = result["buckets"][0] if result["buckets"] else {"total": 0, "expired": 0, "active": 0}
+        return {
+            "total": buckets["total"],
+            "expired": buckets["expired"],
+            "active": buckets["active"],
+            "by_category": {row["_id"]: row["count"] for row in result["by_category"]},
+            "by_currency": {row["_id"]: row["count"] for row in result["by_currency"]},
+            "next_expired": result["next_expired"][0]["expiry_date"] if result["next_expired"] else None,
+            "next_expiring_soon": result["next_expiring_soon"][0]["expiry_date"] if result["next_expiring_soon"] else None
+        }
+
+    async def count_vouchers(self):
+        return await self.db.vouchers.estimated_document_count()
+
+    async def iter_vouchers(self, exclude=()):
+        projection = {"_id": 0, **{name: 0 for name in exclude}}
+        async for voucher in self.db.vouchers.find({}, projection).sort("_id", 1).batch_size(self.batch_size):
+            yield voucher
+
+    async def iter_changed_vouchers(self, after_seq, upto_seq, exclude=()):
+        projection = {"_id": 0, **{name: 0 for name in exclude}}
+        window = {"change_seq": {"$gt": after_seq, "$lte": upto_seq}}
+        async for voucher in self.db.vouchers.find(window, projection).sort("change_seq", 1).batch_size(self.batch_size):
+            yield voucher
+
+    async def add_tombstones(self, tombstones):
+        await self.db.voucher_tombstones.insert_many(tombstones)
+
+    async def iter_tombstones(self, after_seq, upto_seq):
+        window = {"change_seq": {"$gt": after_seq, "$lte": upto_seq}}
+        async for tombstone in self.db.voucher_tombstones.find(window, {"_id": 0}).sort("change_seq", 1):
+            yield tombstone
+
+    async def unexpired_vouchers(self, now, after_id, limit):
+        query = {"expiry_date": {"$gt": now}}
+        if after_id is not None:
+            query["id"] = {"$gt": after_id}
+        return await self.db.vouchers.find(
+            query, {"_id": 0, "id": 1, "expiry_date": 1}
+        ).sort("id", 1).limit(limit).to_list(limit)
+
+    async def due_vouchers(self, now, limit):
+        return await self.db.vouchers.find(
+            {"next_reminder_at": {"$lte": now}},
+            {"_id": 0, "id": 1, "brand_name": 1, "expiry_date": 1}
+        ).limit(limit).to_list(limit)
+
+    async def set_reminder_schedule(self, schedule):
+        if not schedule:
+            return
+        await self.db.vouchers.bulk_write([
+            UpdateOne(
+                {"id": voucher_id},
+                {"$unset": {"next_reminder_at": ""}} if due_at is None else {"$set": {"next_reminder_at": due_at}}
+            )
+            for voucher_id, due_at in schedule.items()
+        ], ordered=False)
+
+    async def queue_reminders(self, reminders):
+        if not reminders:
+            return 0
+        # Unique on (voucher_id, days_left): re-running a check never duplicates
+        operations = [
+            UpdateOne(
+                {"voucher_id": reminder["voucher_id"], "days_left": reminder["days_left"]},
+                {"$setOnInsert": reminder},
+                upsert=True
+            )
+            for reminder in reminders
+        ]
+        try:
+            result = await self.db.pending_reminders.bulk_write(operations, ordered=False)
+            return result.upserted_count
+        except BulkWriteError as e:
+            # A concurrent check inserted the same reminder first
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            return e.details.get("nUpserted", 0)
+
+    async def take_reminders(self, limit, now):
+        reminders = await self.db.pending_reminders.find(
+            {"delivered_at": {"$exists": False}},
+            {"delivered_at": 0}
+        ).sort("created_at", 1).to_list(limit)
+        # Delivered reminders stay (until the TTL) so a re-run never requeues them
+        if reminders:
+            await self.db.pending_reminders.update_many(
+                {"_id": {"$in": [reminder.pop("_id") for reminder in reminders]}},
+                {"$set": {"delivered_at": now}}
+            )
+        return reminders
+
+    UNDELIVERED_REMINDERS = {"id": {"$exists": True}, "delivered_at": {"$exists": False}}
+
+    async def undelivered_reminders(self, after, limit):
+        query = dict(self.UNDELIVERED_REMINDERS)
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        reminders = await self.db.pending_reminders.find(query).sort("_id", 1).limit(limit).to_list(limit)
+        position = reminders[-1]["_id"] if reminders else after
+        for reminder in reminders:
+            reminder.pop("_id")
+        return reminders, position
+
+    async def _run_reminder_feed(self, opened: asyncio.Future, await_seconds: float):
+        """Fan new reminders out to every watcher until none are left.
+
+        Each try_next holds a Motor executor thread for up to `await_seconds`,
+        so watchers share this one stream rather than opening their own.
+        """
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            **{f"fullDocument.{key}": condition for key, condition in self.UNDELIVERED_REMINDERS.items()}
+        }}]
+        error = None
+        try:
+            async with self.db.pending_reminders.watch(pipeline, max_await_time_ms=int(await_seconds * 1000)) as stream:
+                opened.set_result(None)
+                while stream.alive and self._reminder_watchers:
+                    change = await stream.try_next()
+                    if change is None:
+                        continue
+                    reminder = change["fullDocument"]
+                    reminder.pop("_id", None)
+                    for queue in self._reminder_watchers:
+                        queue.put_nowait(reminder)
+            if self._reminder_watchers:
+                error = RuntimeError("Reminder change stream closed")
+        except Exception as e:
+            error = e
+        finally:
+            # Watchers that joined while the stream was closing must reconnect and re-read the backlog
+            self._reminder_feed = None
+            if not opened.done():
+                if error is None:
+                    opened.cancel()
+                else:
+                    opened.set_exception(error)
+            elif error is not None:
+                for queue in self._reminder_watchers:
+                    queue.put_nowait(error)
+
+    async def watch_reminders(self, heartbeat_seconds):
+        """Backlog then the shared change stream of inserts; raises OperationFailure on standalone mongod"""
+        queue = asyncio.Queue()
+        self._reminder_watchers.add(queue)
+        try:
+            opened = self._reminder_feed
+            if opened is None:
+                opened = self._reminder_feed = asyncio.get_running_loop().create_future()
+                self._reminder_feed_task = asyncio.create_task(self._run_reminder_feed(opened, heartbeat_seconds))
+            # Joined before the backlog is read, so nothing inserted in between is missed;
+            # shielded so one watcher going away can't cancel the shared stream
+            await asyncio.shield(opened)
+
+            backlog_ids = set()
+            position = None
+            while True:
+                reminders, position = await self.undelivered_reminders(position, self.batch_size)
+                if not reminders:
+                    break
+                for reminder in reminders:
+                    backlog_ids.add(reminder["id"])
+                    yield reminder
+
+            while True:
+                try:
+                    reminder = await asyncio.wait_for(queue.get(), heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if isinstance(reminder, BaseException):
+                    raise reminder
+                if reminder["id"] not in backlog_ids:
+                    yield reminder
+        finally:
+            self._reminder_watchers.discard(queue)
+
+    async def acknowledge_reminder(self, reminder_id, now):
+        reminder = await self.db.pending_reminders.find_one_and_update(
+            {"id": reminder_id, "delivered_at": {"$exists": False}},
+            {"$set": {"delivered_at": now}},
+            {"_id": 1}
+        )
+        return reminder is not None
+
+    def _settings_document(self, key):
+        collection, selector = self.SETTINGS_DOCUMENTS.get(key, ("reminder_settings", {"id": key}))
+        return self.db[collection], selector
+
+    async def get_settings(self, key):
+        collection, selector = self._settings_document(key)
+        return await collection.find_one(selector, {"_id": 0})
+
+    async def update_settings(self, key, fields, create=True):
+        collection, selector = self._settings_document(key)
+        return await collection.find_one_and_update(
+            selector,
+            {"$set": fields},
+            {"_id": 0},
+            upsert=create
+        )
+
+    async def delete_settings(self, key):
+        collection, selector = self._settings_document(key)
+        await collection.delete_one(selector)
+
+    async def next_sequence(self, name, count=1):
+        counter = await self.db.counters.find_one_and_update(
+            {"id": name},
+            {"$inc": {"seq": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def current_sequence(self, name):
+        counter = await self.db.counters.find_one({"id": name})
+        return counter["seq"] if counter else 0
+
+    async def migration_done(self, name, version):
+        return await self.db.migrations.find_one({"id": name, "version": version}) is not None
+
+    async def record_migration(self, name, version):
+        await self.db.migrations.update_one(
+            {"id": name},
+            {"$set": {"id": name, "version": version, "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+
+class _SortedIndex:
+    """(key, id) pairs kept in order for range scans; entries without a key are not indexed"""
+
+    def __init__(self):
+        self._entries: List[tuple] = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, voucher_id: str):
+        if key is not None:
+            bisect.insort(self._entries, (key, voucher_id))
+
+    def remove(self, key, voucher_id: str):
+        if key is None:
+            return
+        position = bisect.bisect_left(self._entries, (key, voucher_id))
+        if position < len(self._entries) and self._entries[position] == (key, voucher_id):
+            del self._entries[position]
+
+    def ascending(self, start: Optional[tuple] = None, inclusive: bool = True):
+        """Entries from `start` (a key tuple, possibly just `(key,)`) upwards"""
+        if start is None:
+            position = 0
+        else:
+            position = (bisect.bisect_left if inclusive else bisect.bisect_right)(self._entries, start)
+        while position < len(self._entries):
+            yield self._entries[position]
+            position += 1
+
+    def descending(self, before: Optional[tuple] = None):
+        """Entries strictly below `before`, downwards"""
+        position = len(self._entries) if before is None else bisect.bisect_left(self._entries, before)
+        while position > 0:
+            position -= 1
+            yield self._entries[position]
+
+    def count_below(self, key) -> int:
+        return bisect.bisect_left(self._entries, (key,))
+
+    def first_from(self, key):
+        """Smallest key >= `key`"""
+        position = bisect.bisect_left(self._entries, (key,))
+        return self._entries[position][0] if position < len(self._entries) else None
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__}")
+
+
+def _decode(obj: dict):
+    if len(obj) == 1 and "$date" in obj:
+        return datetime.fromisoformat(obj["$date"])
+    return obj
+
+
+def _without(doc: dict, exclude: Sequence[str]) -> dict:
+    return {key: value for key, value in doc.items() if key not in exclude} if exclude else doc
+
+
+def _distance_m(latitude: float, longitude: float, point: dict) -> float:
+    """Great-circle distance to a GeoJSON point"""
+    other_longitude, other_latitude = point["coordinates"]
+    phi1, phi2 = math.radians(latitude), math.radians(other_latitude)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(other_longitude - longitude)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _term_matches(index: Dict[str, set], patterns: Sequence) -> set:
+    """Ids having, for every pattern, some indexed term the pattern matches"""
+    matched = None
+    for pattern in patterns:
+        # Scans the distinct terms, which grow far slower than the vouchers
+        ids = set()
+        for term, term_ids in index.items():
+            if pattern.match(term):
+                ids |= term_ids
+        matched = ids if matched is None else matched & ids
+        if not matched:
+            break
+    return matched or set()
+
+
+class MemoryVoucherRepository(VoucherRepository):
+    """Everything in process, optionally persisted to an append-only log at `path`.
+
+    Each change is applied by replaying a log record, so the log always
+    rebuilds the exact state. Records are flushed (not fsynced) as they are
+    written, so a crash can tear the last one; replay drops a torn last record
+    but refuses to load a log with an unreadable record anywhere else. When
+    the log holds far more records than live documents, it is rewritten as a
+    snapshot.
+    """
+
+    shared = False
+    COMPACT_MIN_RECORDS = 1000
+    COMPACT_RATIO = 2
+
+    def __init__(self, reminder_retention: timedelta, tombstone_retention: timedelta, path: Optional[str] = None):
+        self.reminder_retention = reminder_retention
+        self.tombstone_retention = tombstone_retention
+        self.path = path
+        self._vouchers: Dict[str, dict] = {}
+        self._ids: List[str] = []
+        self._by_brand: Dict[str, set] = {}
+        self._by_region: Dict[str, set] = {}
+        self._by_store_type: Dict[str, set] = {}
+        self._by_region_term: Dict[str, set] = {}
+        self._by_location_term: Dict[str, set] = {}
+        self._by_expiry = _SortedIndex()
+        self._by_created = _SortedIndex()
+        self._by_reminder = _SortedIndex()
+        self._located = set()
+        self._categories = Counter()
+        self._currencies = Counter()
+        self._tombstones: List[dict] = []
+        self._reminders: Dict[str, dict] = {}
+        self._reminder_keys: Dict[tuple, str] = {}
+        self._reminder_positions: Dict[str, int] = {}
+        self._reminder_count = 0
+        self._reminder_signal: Optional[asyncio.Event] = None
+        self._settings: Dict[str, dict] = {}
+        self._sequences: Dict[str, int] = {}
+        self._migrations: Dict[str, int] = {}
+        self._log = None
+        self._records = 0
+        if path:
+            self._open_log()
+
+    # Log
+
+    def _open_log(self):
+        torn = None
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as log:
+                for number, line in enumerate(log, 1):
+                    if not line.strip():
+                        continue
+                    if torn is not None:
+                        # Only the last write can be cut short; anything earlier is real damage
+                        raise ValueError(f"Unreadable record {torn} in {self.path}")
+                    try:
+                        record = json.loads(line, object_hook=_decode)
+                    except ValueError:
+                        torn = number
+                        continue
+                    self._apply(record)
+                    self._records += 1
+            if torn is not None:
+                # A write cut short by a crash; the snapshot below drops it
+                logger.warning(f"Skipping unreadable last record {torn} in {self.path}")
+            logger.info(f"Loaded {len(self._vouchers)} vouchers from {self.path}")
+        if torn is not None or self._should_compact():
+            self.compact()
+        else:
+            self._log = open(self.path, "a", encoding="utf-8")
+
+    def _live_records(self) -> int:
+        return (len(self._vouchers) + len(self._tombstones) + len(self._reminders)
+                + len(self._settings) + len(self._sequences) + len(self._migrations))
+
+    def _should_compact(self) -> bool:
+        return self._records > self.COMPACT_MIN_RECORDS + self.COMPACT_RATIO * self._live_records()
+
+    def _snapshot(self):
+        for name, value in self._sequences.items():
+            yield {"op": "sequence", "name": name, "value": value}
+        for name, version in self._migrations.items():
+            yield {"op": "migration", "name": name, "version": version}
+        for key, doc in self._settings.items():
+            yield {"op": "settings", "key": key, "doc": doc}
+        for doc in self._vouchers.values():
+            yield {"op": "voucher", "doc": doc}
+        for tombstone in self._tombstones:
+            yield {"op": "tombstone", "doc": tombstone}
+        for reminder in self._reminders.values():
+            yield {"op": "reminder", "doc": reminder}
+
+    def compact(self):
+        """Rewrite the log as one record per live document"""
+        if not self.path:
+            return
+        if self._log is not None:
+            self._log.close()
+        temporary = f"{self.path}.tmp"
+        records = 0
+        with open(temporary, "w", encoding="utf-8") as log:
+            for record in self._snapshot():
+                log.write(json.dumps(record, default=_encode, separators=(",", ":")) + "\n")
+                records += 1
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(temporary, self.path)
+        self._records = records
+        self._log = open(self.path, "a", encoding="utf-8")
+
+    def _write(self, records: List[dict]):
+        """Apply records to the in-memory state, then append them to the log"""
+        for record in records:
+            self._apply(record)
+        if self._log is None or not records:
+            return
+        self._log.write("".join(json.dumps(record, default=_encode, separators=(",", ":")) + "\n" for record in records))
+        self._log.flush()
+        self._records += len(records)
+        if self._should_compact():
+            self.compact()
+
+    def _apply(self, record: dict):
+        op = record["op"]
+        if op == "voucher":
+            self._put_voucher(record["doc"])
+        elif op == "delete_voucher":
+            if self._remove_voucher(record["id"]) is not None:
+                del self._ids[bisect.bisect_left(self._ids, record["id"])]
+        elif op == "schedule":
+            self._schedule(record["id"], record["at"])
+        elif op == "tombstone":
+            self._tombstones.append(record["doc"])
+        elif op == "drop_tombstones":
+            self._tombstones = self._tombstones[record["count"]:]
+        elif op == "reminder":
+            self._put_reminder(record["doc"])
+        elif op == "delete_reminder":
+            reminder = self._reminders.pop(record["id"], None)
+            if reminder is not None:
+                self._reminder_keys.pop((reminder["voucher_id"], reminder["days_left"]), None)
+                self._reminder_positions.pop(record["id"], None)
+        elif op == "settings":
+            self._settings[record["key"]] = record["doc"]
+        elif op == "delete_settings":
+            self._settings.pop(record["key"], None)
+        elif op == "sequence":
+            self._sequences[record["name"]] = record["value"]
+        elif op == "migration":
+            self._migrations[record["name"]] = record["version"]
+        else:
+            raise ValueError(f"Unknown storage record {op!r}")
+
+    async def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    # Indexes
+
+    def _hash_keys(self, doc: dict):
+        """(index, key) pairs of the hash indexes listing this voucher"""
+        yield self._by_brand, doc.get("brand_key")
+        yield self._by_region, doc.get("region")
+        yield self._by_store_type, doc.get("store_type")
+        # Term indexes only hold the store type each kind of term is matched on
+        if doc.get("store_type") == "regional":
+            for term in set(doc.get("region_terms") or ()):
+                yield self._by_region_term, term
+        elif doc.get("store_type") == "specific":
+            for term in set(doc.get("location_terms") or ()):
+                yield self._by_location_term, term
+
+    def _put_voucher(self, doc: dict):
+        voucher_id = doc["id"]
+        if self._remove_voucher(voucher_id) is None:
+            bisect.insort(self._ids, voucher_id)
+        self._vouchers[voucher_id] = doc
+        for index, key in self._hash_keys(doc):
+            index.setdefault(key, set()).add(voucher_id)
+        self._by_expiry.add(doc.get("expiry_date"), voucher_id)
+        self._by_created.add(doc.get("created_at"), voucher_id)
+        self._by_reminder.add(doc.get("next_reminder_at"), voucher_id)
+        if doc.get("geo"):
+            self._located.add(voucher_id)
+        self._categories[doc.get("category")] += 1
+        self._currencies[doc.get("currency")] += 1
+
+    def _remove_voucher(self, voucher_id: str) -> Optional[dict]:
+        doc = self._vouchers.pop(voucher_id, None)
+        if doc is None:
+            return None
+        for index, key in self._hash_keys(doc):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(voucher_id)
+                if not ids:
+                    del index[key]
+        self._by_expiry.remove(doc.get("expiry_date"), voucher_id)
+        self._by_created.remove(doc.get("created_at"), voucher_id)
+        self._by_reminder.remove(doc.get("next_reminder_at"), voucher_id)
+        self._located.discard(voucher_id)
+        for counts, key in ((self._categories, doc.get("category")), (self._currencies, doc.get("currency"))):
+            counts[key] -= 1
+            if counts[key] <= 0:
+                del counts[key]
+        return doc
+
+    def _schedule(self, voucher_id: str, due_at: Optional[datetime]):
+        """Change next_reminder_at, touching only the reminder index"""
+        doc = self._vouchers.get(voucher_id)
+        if doc is None:
+            return
+        self._by_reminder.remove(doc.get("next_reminder_at"), voucher_id)
+        # Stored documents are shared with readers, so replace rather than mutate
+        updated = {key: value for key, value in doc.items() if key != "next_reminder_at"}
+        if due_at is not None:
+            updated["next_reminder_at"] = due_at
+            self._by_reminder.add(due_at, voucher_id)
+        self._vouchers[voucher_id] = updated
+
+    def _put_reminder(self, reminder: dict):
+        reminder_id = reminder["id"]
+        if reminder_id not in self._reminder_positions:
+            self._reminder_count += 1
+            self._reminder_positions[reminder_id] = self._reminder_count
+        self._reminders[reminder_id] = reminder
+        self._reminder_keys[(reminder["voucher_id"], reminder["days_left"])] = reminder_id
+
+    # Vouchers
+
+    async def insert_vouchers(self, docs):
+        failures = {}
+        records = []
+        ids = set()
+        for index, doc in enumerate(docs):
+            if doc["id"] in self._vouchers or doc["id"] in ids:
+                failures[index] = DUPLICATE_ID
+                continue
+            ids.add(doc["id"])
+            records.append({"op": "voucher", "doc": doc})
+        self._write(records)
+        return failures
+
+    async def delete_voucher(self, voucher_id):
+        doc = self._vouchers.get(voucher_id)
+        if doc is not None:
+            self._write([{"op": "delete_voucher", "id": voucher_id}])
+        return doc
+
+    async def delete_vouchers(self, ids):
+        found = [self._vouchers[voucher_id] for voucher_id in dict.fromkeys(ids) if voucher_id in self._vouchers]
+        self._write([{"op": "delete_voucher", "id": doc["id"]} for doc in found])
+        return found, True
+
+    async def list_vouchers(self, limit, category=None, store_type=None, region=None,
+                            expiring_before=None, after=None, fields=None):
+        if region is not None:
+            # Usually far fewer than all vouchers, so sort just those
+            entries = sorted(
+                ((self._vouchers[voucher_id]["created_at"], voucher_id) for voucher_id in self._by_region.get(region, ())),
+                reverse=True
+            )
+            if after is not None:
+                entries = [entry for entry in entries if entry < after]
+        else:
+            entries = self._by_created.descending(after)
+
+        vouchers = []
+        for _, voucher_id in entries:
+            doc = self._vouchers[voucher_id]
+            if category is not None and doc.get("category") != category:
+                continue
+            if store_type is not None and doc.get("store_type") != store_type:
+                continue
+            if expiring_before is not None and not (doc.get("expiry_date") and doc["expiry_date"] <= expiring_before):
+                continue
+            vouchers.append(doc)
+            if len(vouchers) >= limit:
+                break
+        return vouchers
+
+    async def expiring_vouchers(self, start, end, limit, after=None, fields=None):
+        entries = (
+            self._by_expiry.ascending(after, inclusive=False)
+            if after is not None and after >= (start,)
+            else self._by_expiry.ascending((start,))
+        )
+        vouchers = []
+        for expiry_date, voucher_id in entries:
+            if expiry_date > end or len(vouchers) >= limit:
+                break
+            vouchers.append(self._vouchers[voucher_id])
+        return vouchers
+
+    async def vouchers_near(self, latitude, longitude, max_distance_m, store_types, limit, fields=None):
+        # Linear in the number of located vouchers, which is small for in-process vaults
+        matches = []
+        for voucher_id in self._located:
+            doc = self._vouchers[voucher_id]
+            if doc.get("store_type") not in store_types:
+                continue
+            distance = _distance_m(latitude, longitude, doc["geo"])
+            if distance <= max_distance_m:
+                matches.append((distance, voucher_id))
+        matches.sort()
+        return [self._vouchers[voucher_id] for _, voucher_id in matches[:limit]]
+
+    async def match_vouchers(self, region_patterns, brand_keys, location_patterns, exclude_ids, limit, fields=None):
+        specific = self._by_store_type.get("specific", set())
+        matched = set()
+        for brand_key in brand_keys:
+            matched |= self._by_brand.get(brand_key, set()) & specific
+        if region_patterns:
+            matched |= _term_matches(self._by_region_term, region_patterns)
+        if location_patterns:
+            matched |= _term_matches(self._by_location_term, location_patterns)
+        matched.difference_update(exclude_ids)
+        return [self._vouchers[voucher_id] for voucher_id in sorted(matched)[:limit]]
+
+    async def vouchers_by_store_type(self, store_type, limit, fields=None):
+        vouchers = []
+        for voucher_id in self._by_store_type.get(store_type, ()):
+            if len(vouchers) >= limit:
+                break
+            vouchers.append(self._vouchers[voucher_id])
+        return vouchers
+
+    async def brand_keys(self):
+        return [brand_key for brand_key in self._by_brand if brand_key]
+
+    async def voucher_stats(self, now, threshold):
+        # Expiry dates have microsecond resolution, so "<= threshold" is "< threshold + 1us"
+        after_threshold = threshold + timedelta(microseconds=1)
+        return {
+            "total": len(self._vouchers),
+            "expired": self._by_expiry.count_below(now),
+            "active": len(self._by_expiry) - self._by_expiry.count_below(after_threshold),
+            "by_category": dict(self._categories),
+            "by_currency": dict(self._currencies),
+            "next_expired": self._by_expiry.first_from(now),
+            "next_expiring_soon": self._by_expiry.first_from(after_threshold)
+        }
+
+    async def count_vouchers(self):
+        return len(self._vouchers)
+
+    async def iter_vouchers(self, exclude=()):
+        for doc in list(self._vouchers.values()):
+            yield _without(doc, exclude)
+
+    async def iter_changed_vouchers(self, after_seq, upto_seq, exclude=()):
+        changed = sorted(
+            (doc for doc in self._vouchers.values() if after_seq < doc.get("change_seq", 0) <= upto_seq),
+            key=lambda doc: doc["change_seq"]
+        )
+        for doc in changed:
+            yield _without(doc, exclude)
+
+    async def add_tombstones(self, tombstones):
+        records = [{"op": "tombstone", "doc": tombstone} for tombstone in tombstones]
+        # Tombstones are appended in deletion order, so expired ones are a prefix
+        cutoff = datetime.now(timezone.utc) - self.tombstone_retention
+        expired = 0
+        while expired < len(self._tombstones) and self._tombstones[expired]["deleted_at"] < cutoff:
+            expired += 1
+        if expired:
+            records.insert(0, {"op": "drop_tombstones", "count": expired})
+        self._write(records)
+
+    async def iter_tombstones(self, after_seq, upto_seq):
+        for tombstone in sorted(self._tombstones, key=lambda tombstone: tombstone["change_seq"]):
+            if after_seq < tombstone["change_seq"] <= upto_seq:
+                yield tombstone
+
+    # Reminder schedule
+
+    async def unexpired_vouchers(self, now, after_id, limit):
+        position = 0 if after_id is None else bisect.bisect_right(self._ids, after_id)
+        vouchers = []
+        while position < len(self._ids) and len(vouchers) < limit:
+            doc = self._vouchers[self._ids[position]]
+            position += 1
+            if doc.get("expiry_date") is not None and doc["expiry_date"] > now:
+                vouchers.append({"id": doc["id"], "expiry_date": doc["expiry_date"]})
+        return vouchers
+
+    async def due_vouchers(self, now, limit):
+        vouchers = []
+        for due_at, voucher_id in self._by_reminder.ascending():
+            if due_at > now or len(vouchers) >= limit:
+                break
+            doc = self._vouchers[voucher_id]
+            vouchers.append({"id": voucher_id, "brand_name": doc.get("brand_name"), "expiry_date": doc.get("expiry_date")})
+        return vouchers
+
+    async def set_reminder_schedule(self, schedule):
+        self._write([
+            {"op": "schedule", "id": voucher_id, "at": due_at}
+            for voucher_id, due_at in schedule.items()
+            if voucher_id in self._vouchers and self._vouchers[voucher_id].get("next_reminder_at") != due_at
+        ])
+
+    # Pending reminders
+
+    async def queue_reminders(self, reminders):
+        records = []
+        # Reminders are kept in queue order, so expired ones are a prefix
+        cutoff = datetime.now(timezone.utc) - self.reminder_retention
+        for reminder in self._reminders.values():
+            if reminder["created_at"] >= cutoff:
+                break
+            records.append({"op": "delete_reminder", "id": reminder["id"]})
+        queued = set()
+        for reminder in reminders:
+            key = (reminder["voucher_id"], reminder["days_left"])
+            if key in self._reminder_keys or key in queued:
+                continue
+            queued.add(key)
+            records.append({"op": "reminder", "doc": reminder})
+        self._write(records)
+        if queued and self._reminder_signal is not None:
+            self._reminder_signal.set()
+            self._reminder_signal = None
+        return len(queued)
+
+    def _undelivered(self, after: int):
+        return [
+            reminder for reminder_id, reminder in self._reminders.items()
+            if self._reminder_positions[reminder_id] > after and "delivered_at" not in reminder
+        ]
+
+    async def take_reminders(self, limit, now):
+        reminders = self._undelivered(0)[:limit]
+        self._write([{"op": "reminder", "doc": {**reminder, "delivered_at": now}} for reminder in reminders])
+        return reminders
+
+    async def undelivered_reminders(self, after, limit):
+        reminders = self._undelivered(after or 0)[:limit]
+        position = self._reminder_positions[reminders[-1]["id"]] if reminders else after
+        return reminders, position
+
+    async def watch_reminders(self, heartbeat_seconds):
+        position = 0
+        while True:
+            reminders = self._undelivered(position)
+            if reminders:
+                for reminder in reminders:
+                    yield reminder
+                position = max(position, self._reminder_positions.get(reminders[-1]["id"], position))
+                continue
+            # No await between reading and waiting, so a reminder can't slip in unseen
+            if self._reminder_signal is None:
+                self._reminder_signal = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._reminder_signal.wait(), heartbeat_seconds)
+            except asyncio.TimeoutError:
+                yield None
+
+    async def acknowledge_reminder(self, reminder_id, now):
+        reminder = self._reminders.get(reminder_id)
+        if reminder is None or "delivered_at" in reminder:
+            return False
+        self._write([{"op": "reminder", "doc": {**reminder, "delivered_at": now}}])
+        return True
+
+    # Settings, sequences and migrations
+
+    async def get_settings(self, key):
+        return self._settings.get(key)
+
+    async def update_settings(self, key, fields, create=True):
+        previous = self._settings.get(key)
+        if previous is not None or create:
+            self._write([{"op": "settings", "key": key, "doc": {**(previous or {"id": key}), **fields}}])
+        return previous
+
+    async def delete_settings(self, key):
+        if key in self._settings:
+            self._write([{"op": "delete_settings", "key": key}])
+
+    async def next_sequence(self, name, count=1):
+        value = self._sequences.get(name, 0) + count
+        self._write([{"op": "sequence", "name": name, "value": value}])
+        return value
+
+    async def current_sequence(self, name):
+        return self._sequences.get(name, 0)
+
+    async def migration_done(self, name, version):
+        return self._migrations.get(name) == version
+
+    async def record_migration(self, name, version):
+        self._write([{"op": "migration", "name": name, "version": version}])
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import "@/App.css";
 import axios from "axios";
 import { Ticket, MapPin, Bell, Plus, Trash2, Search, TrendingUp, Calendar, Tag, Globe, Store, Upload, Camera, Settings, Cloud, RefreshCw } from "lucide-react";
@@ -52,6 +52,8 @@ function App() {
     reminder_days: [7, 3, 1],
     default_currency: "USD"
   });
+  // The reminder stream outlives renders, so it reads the latest settings from here
+  const reminderSettingsRef = useRef(reminderSettings);
   const [notificationPermission, setNotificationPermission] = useState("default");
   const [deferredPrompt, setDeferredPrompt] = useState(null);
   const [showInstallPrompt, setShowInstallPrompt] = useState(false);
@@ -80,7 +82,7 @@ function App() {
     fetchStats();
     fetchReminderSettings();
     checkNotificationPermission();
-    checkPendingReminders();
+    const reminderSource = subscribeToReminders();
     fetchDriveStatus();
     
     // Register service worker
@@ -97,12 +99,13 @@ function App() {
       setShowInstallPrompt(true);
     });
     
-    // Check for reminders every 5 minutes
-    const reminderInterval = setInterval(checkPendingReminders, 5 * 60 * 1000);
-    
-    return () => clearInterval(reminderInterval);
+    return () => reminderSource.close();
   }, []);
 
+  useEffect(() => {
+    reminderSettingsRef.current = reminderSettings;
+  }, [reminderSettings]);
+
   const handleInstallApp = async () => {
     if (!deferredPrompt) return;
     
@@ -263,22 +266,26 @@ function App() {
     }
   };
 
-  const checkPendingReminders = async () => {
-    try {
-      const response = await axios.get(`${API}/pending-reminders`);
-      const reminders = response.data.reminders;
+  const subscribeToReminders = () => {
+    // Reminders are pushed as they are queued; EventSource reconnects on its own
+    const source = new EventSource(`${API}/pending-reminders/stream`);
+    source.addEventListener("reminder", async (event) => {
+      const reminder = JSON.parse(event.data);
+      try {
+        // Only the first ack succeeds, so another open tab won't show it twice
+        await axios.post(`${API}/pending-reminders/${reminder.id}/ack`);
+      } catch (error) {
+        return;
+      }
       
-      if (reminders && reminders.length > 0 && reminderSettings.browser_notifications_enabled) {
-        reminders.forEach(reminder => {
-          showBrowserNotification(
-            `${reminder.brand_name} voucher expiring soon!`,
-            `Your voucher expires in ${reminder.days_left} day(s). Don't miss out!`
-          );
-        });
+      if (reminderSettingsRef.current.browser_notifications_enabled) {
+        showBrowserNotification(
+          `${reminder.brand_name} voucher expiring soon!`,
+          `Your voucher expires in ${reminder.days_left} day(s). Don't miss out!`
+        );
       }
-    } catch (error) {
-      console.error("Failed to check pending reminders", error);
-    }
+    });
+    return source;
   };
 
   const showBrowserNotification = (title, body) => {
@@ -0,0 +1,59 @@
+"""Run the API on the in-memory storage backend, so tests need no MongoDB."""
+import os
+import sys
+from datetime import timedelta
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+# Set before server is imported; the Motor client is created but never used
+os.environ["STORAGE_BACKEND"] = "memory"
+os.environ.setdefault("MONGO_URL", "mongodb://127.0.0.1:1")
+os.environ.setdefault("DB_NAME", "vouchervault_test")
+
+
+@pytest.fixture
+def server():
+    import server
+    return server
+
+
+@pytest.fixture
+def storage_path(tmp_path):
+    return str(tmp_path / "vouchers.log")
+
+
+@pytest.fixture
+def open_repository(server, storage_path):
+    """Open (or reopen) a memory repository on the test's log file"""
+    from storage import MemoryVoucherRepository
+
+    def open_repository():
+        return MemoryVoucherRepository(
+            timedelta(days=server.REMINDER_RETENTION_DAYS),
+            timedelta(days=server.TOMBSTONE_RETENTION_DAYS),
+            storage_path
+        )
+    return open_repository
+
+
+@pytest.fixture
+def client(server, open_repository, monkeypatch):
+    """TestClient on a fresh repository, with every per-process cache emptied"""
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(server, "repository", open_repository())
+    monkeypatch.setattr(server, "brand_index_version", None)
+    server.stats_cache.invalidate()
+    for cache in (server.reminder_settings_cache, server.drive_credentials_cache, server.sync_status_cache):
+        cache.invalidate()
+    with TestClient(server.app) as client:
+        yield client
+
+
+def voucher(**fields):
+    """Request body for a voucher, with the required fields filled in"""
+    return {"brand_name": "Test Brand", "discount_amount": "10% OFF", "voucher_code": "CODE", **fields}
@@ -0,0 +1,109 @@
+"""A local stand-in for the parts of the Drive v3 API the backup engine uses.
+
+Point DRIVE_API_ROOT at `FakeDrive.url` and the real googleapiclient talks to
+it: files.list by name, resumable uploads for files.create/files.update,
+files.delete, plus an OAuth token endpoint for refreshes.
+"""
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDrive:
+    def __init__(self):
+        self.files = {}
+        self.requests = []
+        self.refreshes = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self._server.server_port}/"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def records(self, name: str):
+        """Decoded NDJSON lines of the stored file with this name"""
+        (data,) = [f["data"] for f in self.files.values() if f["name"] == name]
+        return [json.loads(line) for line in gzip.decompress(data).splitlines()]
+
+    def _handler(self):
+        drive = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=None, headers=None):
+                data = json.dumps(body or {}).encode()
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _start_upload(self, file_id):
+                metadata = json.loads(self._body() or b"{}")
+                with drive._lock:
+                    session = str(len(drive._sessions) + 1)
+                    drive._sessions[session] = (file_id, metadata)
+                self._reply(200, headers={"Location": f"{drive.url}upload-session/{session}"})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                drive.requests.append(("GET", url.path))
+                query = parse_qs(url.query).get("q", [""])[0]
+                files = [
+                    {"id": file_id, "name": f["name"]}
+                    for file_id, f in drive.files.items() if f"name='{f['name']}'" in query
+                ]
+                self._reply(200, {"files": files})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                drive.requests.append(("POST", path))
+                if path == "/upload/drive/v3/files":
+                    return self._start_upload(None)
+                if path == "/token":
+                    self._body()
+                    drive.refreshes += 1
+                    return self._reply(200, {
+                        "access_token": f"refreshed-{drive.refreshes}", "expires_in": 3600, "token_type": "Bearer"
+                    })
+                self._reply(404)
+
+            def do_PATCH(self):
+                path = urlparse(self.path).path
+                drive.requests.append(("PATCH", path))
+                self._start_upload(path.rsplit("/", 1)[1])
+
+            def do_PUT(self):
+                path = urlparse(self.path).path
+                drive.requests.append(("PUT", path))
+                file_id, metadata = drive._sessions.pop(path.rsplit("/", 1)[1])
+                data = self._body()
+                with drive._lock:
+                    if file_id is None:
+                        file_id = f"file-{len(drive.requests)}"
+                        drive.files[file_id] = {"name": metadata.get("name")}
+                    drive.files[file_id]["data"] = data
+                self._reply(200, {"id": file_id})
+
+            def do_DELETE(self):
+                path = urlparse(self.path).path
+                drive.requests.append(("DELETE", path))
+                if drive.files.pop(path.rsplit("/", 1)[1], None) is None:
+                    return self._reply(404, {"error": {"code": 404, "message": "File not found"}})
+                self.send_response(204)
+                self.end_headers()
+
+        return Handler
@@ -0,0 +1,124 @@
+import gzip
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from drive_sync import DriveServiceCache, DriveSyncEngine
+
+from .conftest import voucher
+from .fake_drive import FakeDrive
+
+
+@pytest.fixture
+def drive(client, server, monkeypatch):
+    """A fake Drive server the client is connected to"""
+    drive = FakeDrive()
+    monkeypatch.setenv("DRIVE_API_ROOT", drive.url)
+    monkeypatch.setattr(server, "DRIVE_COMPACT_AFTER_SEGMENTS", 2)
+    # App shutdown stops the Drive thread, so each test gets its own engine
+    engine = DriveSyncEngine()
+    monkeypatch.setattr(server, "drive_engine", engine)
+    monkeypatch.setattr(server, "drive_service_cache", DriveServiceCache(engine))
+    connect(client, server, drive, datetime.now(timezone.utc) + timedelta(hours=1))
+    yield drive
+    drive.close()
+
+
+def connect(client, server, drive, expiry):
+    client.portal.call(server.repository.update_settings, "drive_credentials", {
+        "user_id": "default",
+        "access_token": "token",
+        "refresh_token": "refresh",
+        "token_uri": f"{drive.url}token",
+        "client_id": "client",
+        "client_secret": "secret",
+        "scopes": ["https://www.googleapis.com/auth/drive.file"],
+        "expiry": expiry.isoformat(),
+        "updated_at": datetime.now(timezone.utc).isoformat()
+    })
+    server.drive_credentials_cache.invalidate()
+
+
+def sync(client):
+    response = client.post("/api/drive/sync")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def delta_names(drive):
+    return sorted(f["name"] for f in drive.files.values() if "delta" in f["name"])
+
+
+def test_snapshot_delta_and_compaction(client, server, drive):
+    ids = [client.post("/api/vouchers", json=voucher(brand_name=f"Brand {i}", expiry_date="2030-01-01")).json()["id"]
+           for i in range(3)]
+
+    assert sync(client)["mode"] == "snapshot"
+    snapshot = drive.records(server.DRIVE_SNAPSHOT_NAME)
+    assert snapshot[0]["kind"] == "snapshot"
+    assert sorted(record["voucher"]["id"] for record in snapshot[1:]) == sorted(ids)
+    assert "brand_key" not in snapshot[1]["voucher"]
+
+    # Nothing changed: a delta with nothing to upload
+    assert sync(client)["message"] == "Synced 0 changes to Google Drive"
+    assert delta_names(drive) == []
+
+    added = client.post("/api/vouchers", json=voucher(brand_name="Added", expiry_date="2030-01-01")).json()["id"]
+    client.delete(f"/api/vouchers/{ids[0]}")
+    result = sync(client)
+    assert (result["mode"], result["message"]) == ("delta", "Synced 2 changes to Google Drive")
+    (name,) = delta_names(drive)
+    header, *changes = drive.records(name)
+    assert (header["kind"], header["from_seq"], header["to_seq"]) == ("delta", 3, 5)
+    assert [(c["op"], c.get("id") or c["voucher"]["id"]) for c in changes] == [("upsert", added), ("delete", ids[0])]
+
+    client.delete(f"/api/vouchers/{ids[1]}")
+    assert sync(client)["mode"] == "delta"
+    assert len(delta_names(drive)) == 2
+
+    # Two segments reached: the next sync folds them into a fresh snapshot
+    assert sync(client)["mode"] == "snapshot"
+    assert delta_names(drive) == []
+    assert sorted(r["voucher"]["id"] for r in drive.records(server.DRIVE_SNAPSHOT_NAME)[1:]) == sorted([ids[2], added])
+    assert sum(1 for method, _ in drive.requests if method == "PATCH") == 1
+
+    status = client.get("/api/drive/status").json()
+    assert status["connected"] is True
+    assert (status["sync_status"], status["last_sync_mode"], status["voucher_count"]) == ("success", "snapshot", 2)
+
+
+def test_delta_replays_delete_before_reimport(client, server, drive):
+    kept = client.post("/api/vouchers", json=voucher(expiry_date="2030-01-01")).json()["id"]
+    sync(client)
+
+    exported = gzip.decompress(client.get("/api/vouchers/export").content)
+    client.delete(f"/api/vouchers/{kept}")
+    assert client.post("/api/vouchers/import", content=gzip.compress(exported)).json()["inserted"] == 1
+    sync(client)
+
+    (name,) = delta_names(drive)
+    _, *changes = drive.records(name)
+    assert [(c["op"], c.get("id") or c["voucher"]["id"]) for c in changes] == [("delete", kept), ("upsert", kept)]
+    assert [c["seq"] for c in changes] == sorted(c["seq"] for c in changes)
+
+
+def test_expired_token_is_refreshed_and_saved(client, server, drive):
+    connect(client, server, drive, datetime.now(timezone.utc) - timedelta(minutes=5))
+
+    assert sync(client)["mode"] == "snapshot"
+    assert drive.refreshes == 1
+    saved = client.portal.call(server.repository.get_settings, "drive_credentials")
+    assert saved["access_token"] == "refreshed-1"
+
+    # The cached service keeps the refreshed credentials
+    sync(client)
+    assert drive.refreshes == 1
+
+
+def test_disconnect_forgets_credentials_and_status(client, server, drive):
+    sync(client)
+    assert client.post("/api/drive/disconnect").status_code == 200
+
+    status = client.get("/api/drive/status").json()
+    assert (status["connected"], status["last_sync"]) == (False, None)
+    assert client.post("/api/drive/sync").status_code == 400
@@ -0,0 +1,154 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from .conftest import voucher
+
+
+def stored_voucher(server, **fields):
+    doc = server.voucher_document(server.Voucher(**voucher(expiry_date="2030-01-01", **fields)), [])
+    doc["change_seq"] = 1
+    return doc
+
+
+def test_log_replays_after_restart(client, server, open_repository):
+    created = client.post("/api/vouchers", json=voucher(brand_name="Kept", expiry_date="2030-01-01")).json()
+    deleted = client.post("/api/vouchers", json=voucher(brand_name="Gone", expiry_date="2030-01-01")).json()
+    client.delete(f"/api/vouchers/{deleted['id']}")
+    client.post("/api/reminder-settings", json={
+        "email_enabled": False,
+        "browser_notifications_enabled": True,
+        "reminder_days": [5],
+        "default_currency": "EUR"
+    })
+
+    reopened = open_repository()
+    assert list(reopened._vouchers) == [created["id"]]
+    assert reopened._by_brand == {"kept": {created["id"]}}
+    assert asyncio.run(reopened.get_settings("reminder_settings"))["reminder_days"] == [5]
+    assert [t["id"] for t in reopened._tombstones] == [deleted["id"]]
+    assert asyncio.run(reopened.current_sequence("voucher_changes")) == 3
+
+
+def test_compaction_keeps_state(server, open_repository, storage_path):
+    repository = open_repository()
+    docs = [stored_voucher(server, brand_name=f"Brand {i}") for i in range(20)]
+    asyncio.run(repository.insert_vouchers(docs))
+    for doc in docs[:15]:
+        asyncio.run(repository.delete_voucher(doc["id"]))
+    for _ in range(30):
+        asyncio.run(repository.next_sequence("voucher_version"))
+    records = repository._records
+
+    repository.compact()
+    assert repository._records < records
+    with open(storage_path) as log:
+        assert sum(1 for _ in log) == repository._records
+    asyncio.run(repository.close())
+
+    reopened = open_repository()
+    assert sorted(reopened._vouchers) == sorted(doc["id"] for doc in docs[15:])
+    assert asyncio.run(reopened.current_sequence("voucher_version")) == 30
+
+
+def test_log_compacts_on_its_own(server, open_repository, monkeypatch):
+    monkeypatch.setattr(server.MemoryVoucherRepository, "COMPACT_MIN_RECORDS", 10)
+    repository = open_repository()
+    for _ in range(50):
+        asyncio.run(repository.next_sequence("voucher_version"))
+    assert repository._records <= 10 + repository.COMPACT_RATIO * repository._live_records()
+
+
+def test_torn_last_record_is_dropped(server, open_repository, storage_path):
+    repository = open_repository()
+    asyncio.run(repository.insert_vouchers([stored_voucher(server)]))
+    asyncio.run(repository.close())
+    with open(storage_path, "a") as log:
+        log.write('{"op":"voucher","doc":{"id":')
+
+    reopened = open_repository()
+    assert len(reopened._vouchers) == 1
+    asyncio.run(reopened.close())
+    with open(storage_path) as log:
+        assert all(line.endswith("}\n") for line in log)
+
+
+def test_corrupt_record_before_the_end_stops_the_load(server, open_repository, storage_path):
+    repository = open_repository()
+    asyncio.run(repository.insert_vouchers([stored_voucher(server)]))
+    asyncio.run(repository.close())
+    with open(storage_path) as log:
+        intact = log.read()
+    with open(storage_path, "w") as log:
+        log.write("garbage\n" + intact)
+
+    with pytest.raises(ValueError, match="Unreadable record 1"):
+        open_repository()
+    with open(storage_path) as log:
+        assert log.read() == "garbage\n" + intact
+
+
+def test_settings_can_be_deleted(open_repository):
+    repository = open_repository()
+    asyncio.run(repository.update_settings("drive_sync", {"status": "success"}))
+    assert asyncio.run(repository.update_settings("drive_credentials", {"access_token": "t"}, create=False)) is None
+    asyncio.run(repository.delete_settings("drive_sync"))
+    asyncio.run(repository.close())
+
+    reopened = open_repository()
+    assert asyncio.run(reopened.get_settings("drive_sync")) is None
+    assert asyncio.run(reopened.get_settings("drive_credentials")) is None
+
+
+def test_expiring_range_includes_both_bounds(server, open_repository):
+    repository = open_repository()
+    docs = [stored_voucher(server, brand_name=f"Brand {i}") for i in range(3)]
+    for doc, day in zip(docs, (1, 2, 3)):
+        doc["expiry_date"] = datetime(2030, 1, day, tzinfo=timezone.utc)
+    asyncio.run(repository.insert_vouchers(docs))
+
+    found = asyncio.run(repository.expiring_vouchers(
+        datetime(2030, 1, 1, tzinfo=timezone.utc), datetime(2030, 1, 2, tzinfo=timezone.utc), 10
+    ))
+    assert [doc["id"] for doc in found] == [doc["id"] for doc in docs[:2]]
+
+
+def test_reminder_schedule_pages_by_id_and_replays(server, open_repository):
+    repository = open_repository()
+    docs = [stored_voucher(server, brand_name=f"Brand {i}") for i in range(7)]
+    docs[3]["expiry_date"] = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    asyncio.run(repository.insert_vouchers(docs))
+
+    seen, after_id = [], None
+    while page := asyncio.run(repository.unexpired_vouchers(datetime.now(timezone.utc), after_id, 2)):
+        seen.extend(doc["id"] for doc in page)
+        after_id = page[-1]["id"]
+    assert seen == sorted(doc["id"] for i, doc in enumerate(docs) if i != 3)
+
+    due_at = datetime(2029, 12, 25, tzinfo=timezone.utc)
+    asyncio.run(repository.set_reminder_schedule({docs[0]["id"]: due_at}))
+    asyncio.run(repository.close())
+    reopened = open_repository()
+    assert [doc["id"] for doc in asyncio.run(reopened.due_vouchers(due_at, 10))] == [docs[0]["id"]]
+
+
+def test_term_indexes_follow_writes(server, open_repository):
+    from search import prefix_patterns
+
+    repository = open_repository()
+    regional = stored_voucher(server, store_type="regional", region="North Bavaria")
+    specific = stored_voucher(server, store_type="specific", store_location="Main Street Mall")
+    asyncio.run(repository.insert_vouchers([regional, specific]))
+
+    def match(region, location):
+        return [doc["id"] for doc in asyncio.run(repository.match_vouchers(
+            prefix_patterns(region), [], prefix_patterns(location), [], 10
+        ))]
+
+    assert match("bav nor", None) == [regional["id"]]
+    assert match(None, "main mal") == [specific["id"]]
+    assert match("main", "bavaria") == []
+    asyncio.run(repository.delete_voucher(regional["id"]))
+    assert match("bavaria", None) == []
+    assert repository._by_region_term == {}
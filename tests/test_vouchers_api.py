@@ -0,0 +1,179 @@
+import gzip
+import json
+from datetime import datetime, timedelta, timezone
+
+from .conftest import voucher
+
+
+def create(client, **fields):
+    response = client.post("/api/vouchers", json=voucher(**fields))
+    assert response.status_code == 200
+    return response.json()
+
+
+def expiring_in(**delta):
+    return (datetime.now(timezone.utc) + timedelta(**delta)).isoformat()
+
+
+def test_list_pages_with_cursor(client):
+    created = [create(client, brand_name=f"Brand {i}", expiry_date="2030-01-01") for i in range(5)]
+
+    seen = []
+    pages = 0
+    params = {"limit": 2}
+    while True:
+        response = client.get("/api/vouchers", params=params)
+        assert response.status_code == 200
+        seen.extend(v["id"] for v in response.json())
+        pages += 1
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        params["cursor"] = cursor
+
+    assert pages == 3
+    assert seen == [v["id"] for v in client.get("/api/vouchers").json()]
+    assert sorted(seen) == sorted(v["id"] for v in created)
+
+
+def test_list_filters_and_conditional_get(client):
+    create(client, category="Food", expiry_date="2030-01-01")
+    create(client, category="Fashion", expiry_date="2030-01-01")
+
+    response = client.get("/api/vouchers", params={"category": "Food"})
+    assert [v["category"] for v in response.json()] == ["Food"]
+
+    etag = response.headers["etag"]
+    assert client.get("/api/vouchers", headers={"If-None-Match": etag}).status_code == 304
+    create(client, expiry_date="2030-01-01")
+    assert client.get("/api/vouchers", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_invalid_cursor_is_rejected(client):
+    assert client.get("/api/vouchers", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_expiring_soon_matches_stats_window(client):
+    create(client, brand_name="expired", expiry_date=expiring_in(hours=-1))
+    create(client, brand_name="today", expiry_date=expiring_in(hours=1))
+    create(client, brand_name="this week", expiry_date=expiring_in(days=6))
+    create(client, brand_name="later", expiry_date=expiring_in(days=8))
+
+    response = client.get("/api/vouchers/expiring-soon", params={"days": 7})
+    assert [v["brand_name"] for v in response.json()] == ["today", "this week"]
+    assert client.get(
+        "/api/vouchers/expiring-soon", params={"days": 7}, headers={"If-None-Match": response.headers["etag"]}
+    ).status_code == 304
+
+    stats = client.get("/api/vouchers/stats").json()
+    assert (stats["total"], stats["expired"], stats["expiring_soon"], stats["active"]) == (4, 1, 2, 1)
+
+    page = client.get("/api/vouchers/expiring-soon", params={"days": 7, "limit": 1})
+    rest = client.get("/api/vouchers/expiring-soon", params={
+        "days": 7, "limit": 1, "cursor": page.headers["x-next-cursor"]
+    })
+    assert [v["brand_name"] for v in page.json() + rest.json()] == ["today", "this week"]
+
+    assert client.get("/api/vouchers/expiring-soon", params={"days": 100000000}).status_code == 422
+
+
+def test_stats_follow_writes(client):
+    food = create(client, category="Food", currency="EUR", expiry_date="2030-01-01")
+    create(client, category="Food", expiry_date="2030-01-01")
+
+    stats = client.get("/api/vouchers/stats").json()
+    assert stats["total"] == 2
+    assert stats["by_category"] == {"Food": 2}
+    assert stats["by_currency"] == {"EUR": 1, "USD": 1}
+
+    assert client.delete(f"/api/vouchers/{food['id']}").status_code == 200
+    stats = client.get("/api/vouchers/stats").json()
+    assert stats["total"] == 1
+    assert stats["by_currency"] == {"USD": 1}
+
+
+def test_stats_see_writes_from_other_workers(client, server):
+    create(client, expiry_date="2030-01-01")
+    assert client.get("/api/vouchers/stats").json()["total"] == 1
+
+    # Another worker writes to the shared store and bumps the version
+    doc = server.voucher_document(server.Voucher(**voucher(expiry_date="2030-01-01")), [])
+    client.portal.call(server.repository.insert_vouchers, [doc])
+    client.portal.call(server.bump_voucher_version)
+    assert client.get("/api/vouchers/stats").json()["total"] == 2
+
+
+def test_stats_recount_after_legacy_expiry(client, server):
+    create(client, expiry_date="2030-01-01")
+    assert client.get("/api/vouchers/stats").json()["total"] == 1
+
+    # Unconverted legacy documents keep free-form expiry strings
+    server.stats_cache.apply({"expiry_date": "end of next month"}, -1)
+    assert client.get("/api/vouchers/stats").json()["total"] == 1
+
+
+def test_nearby_fetches_best_tiers_first(client, server, monkeypatch):
+    monkeypatch.setattr(server, "NEARBY_LIMIT", 3)
+    for i in range(4):
+        create(client, brand_name=f"Regional {i}", store_type="regional", region="Bavaria", expiry_date="2030-01-01")
+        create(client, brand_name="Acme Outlet", store_type="specific", expiry_date="2030-01-01")
+    exact = create(client, brand_name="Acme", store_type="specific", expiry_date="2030-01-01")
+
+    found = client.post("/api/vouchers/nearby", json={"region": "Bavaria", "store_name": "Acme"}).json()
+    assert found[0]["id"] == exact["id"]
+    assert [v["brand_name"] for v in found[1:]] == ["Acme Outlet", "Acme Outlet"]
+
+
+def test_reminders_are_scheduled_and_queued_once(client, server):
+    client.post("/api/reminder-settings", json={
+        "email_enabled": False,
+        "browser_notifications_enabled": True,
+        "reminder_days": [7, 3],
+        "default_currency": "USD"
+    })
+    due = create(client, brand_name="Due", expiry_date=expiring_in(days=3, hours=12))
+    later = create(client, brand_name="Later", expiry_date=expiring_in(days=20))
+
+    stored = client.portal.call(server.repository.due_vouchers, datetime.now(timezone.utc), 10)
+    assert [v["id"] for v in stored] == [due["id"]]
+    later_at = server.repository._vouchers[later["id"]]["next_reminder_at"]
+    assert later_at == datetime.fromisoformat(later["expiry_date"]) - timedelta(days=8) + timedelta(milliseconds=1)
+
+    client.portal.call(server.check_and_send_reminders)
+    client.portal.call(server.check_and_send_reminders)
+
+    reminders = client.get("/api/pending-reminders").json()["reminders"]
+    assert [(r["voucher_id"], r["days_left"]) for r in reminders] == [(due["id"], 3)]
+    assert client.get("/api/pending-reminders").json()["reminders"] == []
+    # The 3-day window is handled and no earlier one is left
+    assert "next_reminder_at" not in server.repository._vouchers[due["id"]]
+
+
+def test_export_import_round_trip(client):
+    originals = [create(client, brand_name=f"Brand {i}", expiry_date="2030-01-01") for i in range(3)]
+
+    response = client.get("/api/vouchers/export")
+    assert response.status_code == 200
+    exported = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+    assert sorted(v["id"] for v in exported) == sorted(v["id"] for v in originals)
+    assert all("brand_key" not in v and "next_reminder_at" not in v for v in exported)
+
+    client.request("DELETE", "/api/vouchers/bulk", json={"ids": [v["id"] for v in originals]})
+    assert client.get("/api/vouchers").json() == []
+
+    body = gzip.compress(b"".join(json.dumps(v).encode() + b"\n" for v in exported) + b"not json\n")
+    result = client.post("/api/vouchers/import", content=body).json()
+    assert result["inserted"] == 3
+    assert [error["line"] for error in result["errors"]] == [4]
+
+    restored = {v["id"]: v for v in client.get("/api/vouchers").json()}
+    assert restored == {v["id"]: v for v in originals}
+
+    again = client.post("/api/vouchers/import", content=body).json()
+    assert again["inserted"] == 0
+    assert again["failed"] == 4
+
+
+def test_scan_jobs_need_mongo(client):
+    response = client.post("/api/vouchers/scan-jobs", content=b"{}", headers={"content-type": "application/x-ndjson"})
+    assert response.status_code == 503